@@ -0,0 +1,159 @@
+"""
+Time the --egnyte-sync and --cdd-assay-runs flows end to end against local stand-in servers.
+
+    python -m benchmarks.bench_end_to_end [scenario ...] [--update-baseline] [--tolerance 0.5]
+
+Every scenario runs in its own process so the shared transport, caches and stores start cold.
+Results are checked for correctness (one slurp per run group, every file attached and marked Success)
+and compared with benchmarks/baselines.json: a flow slower than baseline * (1 + tolerance), or a
+change in request counts for an error free scenario, fails the run.
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+# batches only matter for unattributed runs, they are paged up to CDD_ASYNC_EXPORT_THRESHOLD and exported above it
+SCENARIOS = {
+    'small': {'files': 10, 'rows': 384, 'latency': 0.0, 'error_rate': 0.0, 'batches': 0, 'attributed': True},
+    'latency': {'files': 10, 'rows': 384, 'latency': 0.02, 'error_rate': 0.0, 'batches': 0, 'attributed': True},
+    'errors': {'files': 10, 'rows': 384, 'latency': 0.0, 'error_rate': 0.05, 'batches': 0, 'attributed': True},
+    'large': {'files': 40, 'rows': 1536, 'latency': 0.005, 'error_rate': 0.0, 'batches': 1500, 'attributed': False},
+}
+
+PROJECT = 'Bench Project'
+FOLDER = '/Shared/External/Bench'
+
+
+def configure(tmp_dir, cdd, egnyte):
+    import settings
+    settings.CDD_BASE_URL = cdd.url + '/api/v1/vaults'
+    settings.CDD_KEY = 'bench'
+    settings.CDD_VAULT_ID = cdd.vault_id
+    settings.CDD_PROJECT_NAME_LABEL = 'Project'
+    settings.CDD_PROJECTS = {PROJECT: {'research_projects': {PROJECT: {'data_url': cdd.url + '/data',
+                                                                       'webhook_url': cdd.url + '/teams'}}}}
+    settings.EGNYTE_DOMAIN = 'bench.egnyte.com'
+    settings.EGNYTE_ACCESS_TOKEN = 'bench'
+    settings.EGNYTE_BASE_URL = egnyte.url
+    settings.EGNYTE_BASE_PATH = '/Shared/External'
+    settings.EGNYTE_RATE_LIMIT = (1000, 1000)
+    settings.CHECKPOINT_PATH = os.path.join(tmp_dir, 'checkpoints.sqlite3')
+    settings.CDD_CACHE_PATH = os.path.join(tmp_dir, 'cdd_cache.sqlite3')
+    settings.CDD_MOLECULE_INDEX_PATH = os.path.join(tmp_dir, 'cdd_molecule_index.sqlite3')
+    settings.ASSAY_CONTENT_CACHE_PATH = os.path.join(tmp_dir, 'assay_content_cache.sqlite3')
+    settings.CDD_POLL_INITIAL_INTERVAL = 0.05
+    settings.CDD_POLL_MAX_INTERVAL = 0.2
+    settings.HTTP_BACKOFF_FACTOR = 0.01
+    settings.METRICS_PROMETHEUS_PATH = settings.METRICS_SUMMARY_PATH = None
+
+
+def run_scenario(name, options, tmp_dir, verbose=False):
+    from benchmarks.fake_servers import FakeCddServer, FakeEgnyteServer, FakeServerConfig, make_plate_workbook
+    config = dict(latency=options['latency'], error_rate=options['error_rate'])
+    cdd = FakeCddServer(1, PROJECT, num_batches=options['batches'], attributed=options['attributed'],
+                        config=FakeServerConfig(seed=1, **config)).start()
+    egnyte = FakeEgnyteServer('/Shared/External', config=FakeServerConfig(seed=2, **config)).start()
+    egnyte.add_folder(FOLDER, {'mapping template id': 1})
+    # the poller starts after the oldest event, so the folder creation comes first
+    egnyte.add_event('create', FOLDER, is_folder=True)
+    for i in range(options['files']):
+        egnyte.add_file('{}/plate_{:03d}.xlsx'.format(FOLDER, i), make_plate_workbook(options['rows'], seed=i))
+
+    os.chdir(tmp_dir)
+    configure(tmp_dir, cdd, egnyte)
+    import main
+    from local_lib.checkpoint import get_checkpoint_store
+    logging.getLogger().setLevel(logging.INFO if verbose else logging.WARNING)
+    get_checkpoint_store().set_cursor('egnyte_event_id:bench.egnyte.com', 0)
+
+    result = {'scenario': name, 'options': options, 'seconds': {}, 'checks': {}}
+    started = time.perf_counter()
+    main.sync_egnyte_assay_files(False)
+    result['seconds']['egnyte_sync'] = round(time.perf_counter() - started, 3)
+    statuses = [f['properties'].get('status') for f in egnyte.files.values()]
+    result['checks']['slurps'] = len(cdd.slurps) == 1
+    result['checks']['files_processing'] = statuses.count('Processing') == options['files']
+
+    started = time.perf_counter()
+    main.process_cdd_assay_runs(False)
+    result['seconds']['cdd_assay_runs'] = round(time.perf_counter() - started, 3)
+    statuses = [f['properties'].get('status') for f in egnyte.files.values()]
+    result['checks']['attachments'] = len(cdd.attachments) == options['files']
+    result['checks']['files_success'] = statuses.count('Success') == options['files']
+    result['checks']['runs_marked'] = all(_.get('place') == 'Yes' for _ in cdd.runs.values())
+    result['checks']['teams_posted'] = len(cdd.teams_posts) == 1
+
+    result['requests'] = {'cdd': dict(sorted(cdd.requests.items())), 'egnyte': dict(sorted(egnyte.requests.items()))}
+    result['bytes_uploaded'] = cdd.bytes_received
+    cdd.stop()
+    egnyte.stop()
+    return result
+
+
+def compare(result, baseline, tolerance):
+    problems = ["check failed: {}".format(k) for k, ok in result['checks'].items() if not ok]
+    if baseline:
+        for flow, seconds in result['seconds'].items():
+            limit = baseline['seconds'][flow] * (1 + tolerance)
+            if seconds > limit:
+                problems.append("{} took {:.2f}s, baseline {:.2f}s".format(flow, seconds, baseline['seconds'][flow]))
+        if not result['options']['error_rate'] and result['requests'] != baseline['requests']:
+            problems.append("request counts changed")
+    return problems
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='End to end benchmark against local CDD and Egnyte stand-ins.')
+    parser.add_argument('scenarios', nargs='*', default=['small', 'latency', 'errors'],
+                        help='any of: {}'.format(", ".join(SCENARIOS)))
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--run-scenario', help=argparse.SUPPRESS)
+    parser.add_argument('--work-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args(args)
+    unknown = [_ for _ in args.scenarios if _ not in SCENARIOS]
+    if unknown:
+        parser.error("unknown scenarios: {}".format(", ".join(unknown)))
+
+    if args.run_scenario:
+        result = run_scenario(args.run_scenario, SCENARIOS[args.run_scenario], args.work_dir, args.verbose)
+        with open(os.path.join(args.work_dir, 'result.json'), 'w') as f:
+            json.dump(result, f)
+        return 0
+
+    baselines = {}
+    if os.path.exists(BASELINES_PATH):
+        with open(BASELINES_PATH) as f:
+            baselines = json.load(f)
+    failed = False
+    print("{:<10} {:>12} {:>15}  {}".format('scenario', 'egnyte_sync', 'cdd_assay_runs', 'result'))
+    for name in args.scenarios:
+        with tempfile.TemporaryDirectory(prefix='bench_') as work_dir:
+            command = [sys.executable, '-m', 'benchmarks.bench_end_to_end', '--run-scenario', name, '--work-dir', work_dir]
+            subprocess.run(command + (['--verbose'] if args.verbose else []), check=True,
+                           stdout=None if args.verbose else subprocess.DEVNULL,
+                           cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            with open(os.path.join(work_dir, 'result.json')) as f:
+                result = json.load(f)
+        problems = compare(result, None if args.update_baseline else baselines.get(name), args.tolerance)
+        failed = failed or bool(problems)
+        print("{:<10} {:>11.2f}s {:>14.2f}s  {}".format(name, result['seconds']['egnyte_sync'],
+                                                       result['seconds']['cdd_assay_runs'], "; ".join(problems) or "ok"))
+        if args.update_baseline and not problems:
+            baselines[name] = {k: result[k] for k in ('options', 'seconds', 'requests')}
+    if args.update_baseline:
+        with open(BASELINES_PATH, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
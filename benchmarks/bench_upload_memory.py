@@ -0,0 +1,76 @@
+"""
+Peak Python memory of CddInterface slurp submission, buffered vs streaming CSV.
+
+    python -m benchmarks.bench_upload_memory [rows_per_file ...]
+"""
+import http.server
+import json
+import sys
+import threading
+import tracemalloc
+
+import settings
+from local_lib.cdd_interface import CddInterface
+from local_lib.resources import AssayRunFile
+
+FILES_PER_GROUP = 10
+
+
+class SinkHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                self.rfile.read(size + 2)
+                if not size:
+                    break
+        else:
+            remaining = int(self.headers['Content-Length'])
+            while remaining:
+                remaining -= len(self.rfile.read(min(remaining, 1 << 16)))
+        body = json.dumps({'id': 1, 'state': 'committed'}).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_group(rows_per_file):
+    header = ['Compound', 'Batch', 'Conc', 'Value', 'Temperature']
+    return [AssayRunFile([header] + [['CMPD-{}'.format(i), 'CMPD-{}-001'.format(i), 1.0, i * 0.5, 37]
+                                     for i in range(rows_per_file)], 'f{}.xlsx'.format(n), n, n)
+            for n in range(FILES_PER_GROUP)]
+
+
+def measure(cdd_interface, assay_run, streaming):
+    settings.CDD_STREAMING_UPLOAD = streaming
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    upload = cdd_interface._build_assay_run_upload(assay_run, 1, 1, 'bench', 'bench.csv')
+    cdd_interface._submit_slurp(*upload)
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    return peak
+
+
+def main(sizes):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), SinkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    settings.CDD_BASE_URL = 'http://127.0.0.1:{}'.format(server.server_port)
+    cdd_interface = CddInterface('bench', 'vault')
+    print("{:>10} {:>14} {:>16}".format('rows', 'buffered (MB)', 'streaming (MB)'))
+    for rows_per_file in sizes:
+        assay_run = make_group(rows_per_file)
+        buffered = measure(cdd_interface, assay_run, False)
+        streaming = measure(cdd_interface, assay_run, True)
+        print("{:>10} {:>14.2f} {:>16.2f}".format(rows_per_file * FILES_PER_GROUP, buffered / 2 ** 20, streaming / 2 ** 20))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main([int(_) for _ in sys.argv[1:]] or [1000, 10000, 50000])
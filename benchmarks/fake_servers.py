@@ -0,0 +1,324 @@
+"""
+Local stand-ins for the CDD vault REST API and the Egnyte public API, used by the offline benchmarks.
+
+Both servers keep their state in memory, add a fixed latency to every request and can inject errors:
+idempotent requests fail with a 503 and POSTs are throttled with a 429, which the transport retries.
+"""
+import hashlib
+import http.server
+import json
+import random
+import re
+import threading
+import time
+import uuid
+
+from datetime import datetime
+from io import BytesIO
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import openpyxl
+
+from local_lib.metrics import endpoint_label
+
+MAPPING_TEMPLATE_ID = 1
+PROTOCOL_NAME = 'Bench Protocol'
+HEADER = ['Well', 'Compound', 'Batch', 'Conc', 'Value', 'Temperature']
+WELL_ROWS = 'ABCDEFGHIJKLMNOP'
+
+
+class FakeServerConfig:
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+
+def make_plate_workbook(num_rows, seed=0, sheet_name='format_raw_data_vault'):
+    """xlsx bytes of a synthetic 384 well plate export with num_rows readout rows"""
+    rng = random.Random(seed)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+    ws.append(HEADER)
+    for i in range(num_rows):
+        compound = 'CMPD-{}'.format(rng.randrange(1, 5000))
+        well = '{}{:02d}'.format(WELL_ROWS[(i // 24) % 16], i % 24 + 1)
+        ws.append([well, compound, compound + '-001', rng.choice([0.1, 1.0, 10.0]), rng.random() * 100, 37])
+    f = BytesIO()
+    wb.save(f)
+    return f.getvalue()
+
+
+def read_body(handler):
+    if handler.headers.get('Transfer-Encoding') == 'chunked':
+        body = b""
+        while True:
+            size = int(handler.rfile.readline().strip(), 16)
+            body += handler.rfile.read(size + 2)[:size]
+            if not size:
+                return body
+    return handler.rfile.read(int(handler.headers.get('Content-Length') or 0))
+
+
+def multipart_field(body, name):
+    match = re.search(b'name="' + name.encode() + b'"\r\n\r\n(.*?)\r\n--', body, re.S)
+    return match.group(1).decode() if match else None
+
+
+class FakeHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code, body=None, headers=None):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode() if body is not None else b""
+        self.send_response(code)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self):
+        server = self.server
+        body = read_body(self)
+        server.count(self.command, urlsplit(self.path).path, len(body))
+        time.sleep(server.config.latency)
+        if server.config.error_rate and server.config.random.random() < server.config.error_rate:
+            if self.command == 'POST':
+                return self._send(429, {'error': 'throttled'}, {'Retry-After': '0'})
+            return self._send(503, {'error': 'injected'})
+        split = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(split.query).items()}
+        try:
+            payload = json.loads(body) if body and self.headers.get('Content-Type', '').startswith('application/json') else None
+        except ValueError:
+            payload = None
+        result = server.route(self.command, unquote(split.path), query, payload, body, self.headers)
+        self._send(*result) if isinstance(result, tuple) else self._send(200, result)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+
+class FakeServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config=None):
+        super().__init__(('127.0.0.1', 0), FakeHandler)
+        self.config = config or FakeServerConfig()
+        self.lock = threading.RLock()
+        self.requests = {}
+        self.bytes_received = 0
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_port)
+
+    def count(self, method, path, size):
+        key = "{} {}".format(method, endpoint_label(unquote(path)))
+        with self.lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.bytes_received += size
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeEgnyteServer(FakeServer):
+    """Egnyte pubapi: fs metadata, custom properties, fs-content, search and the events queue"""
+
+    def __init__(self, base_path, config=None):
+        super().__init__(config)
+        self.base_path = base_path
+        self.folders = {}
+        self.files = {}
+        self.events = []
+
+    def add_folder(self, path, cdd_data):
+        self.folders[path] = {'is_folder': True, 'path': path, 'name': path.rsplit('/', 1)[-1],
+                              'custom_metadata': [{'cdd': cdd_data}] if cdd_data else []}
+
+    def add_file(self, path, content):
+        with self.lock:
+            group_id = str(uuid.uuid4())
+            self.files[path] = {'is_folder': False, 'path': path, 'name': path.rsplit('/', 1)[-1], 'group_id': group_id,
+                                'entry_id': str(uuid.uuid4()), 'size': len(content), 'properties': {},
+                                'checksum': hashlib.sha512(content).hexdigest(),
+                                'content': content}
+            self.add_event('create', path, self.files[path]['entry_id'])
+
+    def add_event(self, action, path, entry_id=None, is_folder=False):
+        self.events.append({'id': len(self.events) + 1, 'action': action, 'type': 'file_system',
+                            'data': {'target_path': path, 'target_id': entry_id, 'is_folder': is_folder}})
+
+    def _file_by_group_id(self, group_id):
+        return next((_ for _ in self.files.values() if _['group_id'] == group_id), None)
+
+    def _describe(self, f):
+        description = {k: v for k, v in f.items() if k not in ('content', 'properties')}
+        description['custom_metadata'] = [{'cdd': dict(f['properties'])}] if f['properties'] else []
+        return description
+
+    def route(self, method, path, query, payload, body, headers):
+        path = path[len('/pubapi/v1'):] if path.startswith('/pubapi/v1') else path
+        with self.lock:
+            if path == '/events/cursor':
+                return {'latest_event_id': len(self.events), 'oldest_event_id': 1 if self.events else 0}
+            if path == '/events':
+                start, count = int(query.get('id', 0)), int(query.get('count', 100))
+                events = [_ for _ in self.events if _['id'] > start][:count]
+                if not events:
+                    return 204, None
+                return {'events': events, 'latest_id': len(self.events)}
+            if path == '/search' and method == 'POST':
+                wanted = {(_['namespace'], _['key']): _['value'] for _ in payload['key_with_value']}
+                results = []
+                for f in self.files.values():
+                    if all(f['properties'].get(key) == value for (_, key), value in wanted.items()):
+                        result = self._describe(f)
+                        result['path'] = f['path'].rsplit('/', 1)[0]
+                        result['file_custom_properties'] = [{'namespace': 'cdd', 'key': k, 'value': v}
+                                                            for k, v in f['properties'].items()]
+                        results.append(result)
+                return {'results': results, 'total_count': len(results)}
+            match = re.match(r'^/fs/ids/file/([^/]+)(/properties/([^/]+))?$', path)
+            if match:
+                f = self._file_by_group_id(match.group(1))
+                if f is None:
+                    return 404, {'error': 'not found'}
+                if method == 'PUT':
+                    f['properties'].update(payload)
+                    return 204, None
+                return self._describe(f)
+            match = re.match(r'^/fs-content(/ids/file/([^/]+)|(/.*))$', path)
+            if match:
+                f = self._file_by_group_id(match.group(2)) if match.group(2) else self.files.get(match.group(3))
+                return (200, f['content']) if f else (404, {'error': 'not found'})
+            if path.startswith('/fs/'):
+                item = self.folders.get(path[3:].rstrip('/')) or self.files.get(path[3:])
+                if item is None:
+                    return 404, {'error': 'not found'}
+                return item if item['is_folder'] else self._describe(item)
+        return 404, {'error': 'unknown endpoint {} {}'.format(method, path)}
+
+
+class FakeCddServer(FakeServer):
+    """CDD vault API: mapping templates, protocols with runs, slurps, files, runs, batches, readout rows and exports"""
+
+    def __init__(self, vault_id, project, num_batches=0, attributed=True, slurp_polls=2, export_polls=2, config=None):
+        super().__init__(config)
+        self.vault_id = str(vault_id)
+        self.project = project
+        self.slurp_polls = slurp_polls
+        self.export_polls = export_polls
+        self.slurps = {}
+        self.runs = {}
+        self.attachments = []
+        self.exports = {}
+        self.teams_posts = []
+        created_at = datetime.now().isoformat()
+        self.batches = [{'id': i, 'molecule': {'id': i}, 'created_at': created_at, 'modified_at': created_at,
+                         'batch_fields': {'Project': project}} for i in range(1, num_batches + 1)]
+        # runs of a protocol without a project are attributed through their molecules' batches
+        self.protocol = {'id': 1, 'name': PROTOCOL_NAME, 'modified_at': '2024-01-01T00:00:00',
+                         'protocol_fields': {'Project': project} if attributed else {},
+                         'readout_definitions': [{'id': 1, 'protocol_condition': False},
+                                                 {'id': 2, 'protocol_condition': False},
+                                                 {'id': 3, 'protocol_condition': True}]}
+        self.mapping_template = {'id': MAPPING_TEMPLATE_ID, 'modified_at': '2024-01-01T00:00:00', 'header_mappings': [
+            {'header': {'name': 'Well'}, 'definition': {'type': 'InternalFieldDefinition::WellLocation'}},
+            {'header': {'name': 'Compound'}, 'definition': {'type': 'InternalFieldDefinition::MoleculeSynonym'}},
+            {'header': {'name': 'Batch'}, 'definition': {'type': 'InternalFieldDefinition::BatchName'}},
+        ] + [{'header': {'name': name}, 'definition': {'type': 'ReadoutDefinition', 'id': i, 'name': name,
+                                                       'protocol_name': PROTOCOL_NAME}}
+             for i, name in enumerate(['Conc', 'Value', 'Temperature'], start=1)]}
+
+    def _listing(self, objects, payload, query):
+        payload = payload or {}
+        if payload.get('async'):
+            export_id = len(self.exports) + 1
+            self.exports[export_id] = {'polls': 0, 'objects': objects}
+            return {'id': export_id}
+        page_size = int(payload.get('page_size') or query.get('page_size') or 1000)
+        offset = int(payload.get('offset') or query.get('offset') or 0)
+        return {'count': len(objects), 'offset': offset, 'page_size': page_size,
+                'objects': objects[offset:offset + page_size]}
+
+    def _cached(self, value, headers):
+        etag = '"{}"'.format(value['modified_at'])
+        if headers.get('If-None-Match') == etag:
+            return 304, None, {'ETag': etag}
+        return 200, value, {'ETag': etag}
+
+    def route(self, method, path, query, payload, body, headers):
+        if path == '/teams':
+            self.teams_posts.append(payload)
+            return {'ok': True}
+        prefix = '/api/v1/vaults/{}/'.format(self.vault_id)
+        if not path.startswith(prefix):
+            return 404, {'error': 'unknown vault'}
+        path = path[len(prefix):]
+        with self.lock:
+            if path == 'mapping_templates/{}'.format(MAPPING_TEMPLATE_ID):
+                return self._cached(self.mapping_template, headers)
+            if path == 'protocols':
+                if query.get('names'):
+                    return self._cached({'count': 1, 'modified_at': self.protocol['modified_at'],
+                                         'objects': [self.protocol]}, headers)
+                runs = [dict(_) for _ in self.runs.values()]
+                modified_after = query.get('runs_modified_after') or ''
+                protocols = [dict(self.protocol, runs=runs)] if any(_['modified_at'] > modified_after for _ in runs) else []
+                return self._listing(protocols, payload, query)
+            if path == 'slurps' and method == 'POST':
+                data = json.loads(multipart_field(body, 'json'))
+                slurp_id = len(self.slurps) + 1
+                self.slurps[slurp_id] = {'polls': 0, 'data': data, 'bytes': len(body)}
+                return {'id': slurp_id, 'state': 'processing'}
+            match = re.match(r'^slurps/(\d+)$', path)
+            if match:
+                slurp = self.slurps[int(match.group(1))]
+                slurp['polls'] += 1
+                if slurp['polls'] < self.slurp_polls:
+                    return {'id': int(match.group(1)), 'state': 'processing'}
+                if 'run_id' not in slurp:
+                    slurp['run_id'] = len(self.runs) + 1
+                    self.runs[slurp['run_id']] = {'id': slurp['run_id'], 'conditions': slurp['data']['runs']['conditions'],
+                                                  'modified_at': datetime.now().isoformat()}
+                return {'id': int(match.group(1)), 'state': 'committed'}
+            match = re.match(r'^runs/(\d+)$', path)
+            if match and method == 'PUT':
+                self.runs[int(match.group(1))].update(payload, modified_at=datetime.now().isoformat())
+                return self.runs[int(match.group(1))]
+            if path == 'files' and method == 'POST':
+                self.attachments.append({'resource_id': multipart_field(body, 'resource_id'), 'bytes': len(body)})
+                return {'id': len(self.attachments)}
+            if path == 'batches':
+                modified_after = (payload or {}).get('modified_after') or ''
+                return self._listing([_ for _ in self.batches if _['modified_at'] >= modified_after], payload, query)
+            if path == 'molecules':
+                return self._listing([_['molecule'] for _ in self.batches], payload, query)
+            if path == 'readout_rows':
+                run_ids = [int(_) for _ in str((payload or {}).get('runs', '')).split(',') if _]
+                rows = [{'run': {'id': run_id}, 'molecule': batch['molecule']['id']}
+                        for run_id in run_ids for batch in self.batches[:10]]
+                return self._listing(rows, payload, query)
+            match = re.match(r'^export_progress/(\d+)$', path)
+            if match:
+                export = self.exports[int(match.group(1))]
+                export['polls'] += 1
+                return {'id': int(match.group(1)), 'status': 'finished' if export['polls'] >= self.export_polls else 'started'}
+            match = re.match(r'^exports/(\d+)$', path)
+            if match:
+                if method == 'DELETE':
+                    self.exports.pop(int(match.group(1)), None)
+                    return {}
+                objects = self.exports[int(match.group(1))]['objects']
+                return {'count': len(objects), 'objects': objects}
+        return 404, {'error': 'unknown endpoint {} {}'.format(method, path)}
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import random
+import settings
+import time
+
+from local_lib.metrics import get_metrics
+
+root_log = logging.getLogger()
+
+# set by the daemon when it shuts down, cancellable jobs are abandoned instead of waited for
+_stop_event = None
+STOP_CHECK_INTERVAL = 1
+
+
+def set_stop_event(event):
+    """Register a threading.Event that cancels the cancellable jobs of every tracker once it is set"""
+    global _stop_event
+    _stop_event = event
+
+
+class AsyncJob:
+    """
+    A server side job (CDD export or slurp) polled by the AsyncJobTracker.
+    check() blocks for one status request and returns (done, result); it raises if the job failed.
+    cancel() is called when the job is abandoned because of a deadline or interrupt.
+    """
+
+    def __init__(self, name, check, cancel=None):
+        self.name = name
+        self.check = check
+        self.cancel = cancel
+        self.future = None
+        self.interval = None
+        self.next_poll = None
+        self.started = None
+
+
+class AsyncJobTracker:
+    """
+    Polls every submitted job from one asyncio scheduler loop with exponential backoff and jitter.
+    Once stop_event is set the jobs that can be cancelled are, jobs without a cancel() are still waited for.
+    """
+
+    def __init__(self, initial_interval=None, max_interval=None, deadline=None, stop_event=None):
+        self.initial_interval = initial_interval or settings.CDD_POLL_INITIAL_INTERVAL
+        self.max_interval = max_interval or settings.CDD_POLL_MAX_INTERVAL
+        self.deadline = deadline or settings.CDD_JOB_DEADLINE
+        self.stop_event = stop_event if stop_event is not None else _stop_event
+        self.jobs = []
+        self._wakeup = None
+
+    def submit(self, job):
+        loop = asyncio.get_running_loop()
+        job.future = loop.create_future()
+        job.interval = self.initial_interval
+        job.started = job.next_poll = loop.time()
+        self.jobs.append(job)
+        if self._wakeup:
+            self._wakeup.set()
+        return job.future
+
+    def _jitter(self, interval):
+        return interval * random.uniform(0.8, 1.2)
+
+    def _record_wait(self, job, status):
+        waited = asyncio.get_running_loop().time() - job.started
+        get_metrics().observe('cdd_job_wait_seconds', waited, job=job.name.split()[0], status=status)
+        return waited
+
+    async def _poll(self, job):
+        try:
+            done, result = await asyncio.to_thread(job.check)
+        except Exception as e:
+            self._record_wait(job, 'error')
+            job.future.set_exception(e)
+            return
+        if done:
+            root_log.info("Job {} finished after {:.1f}s".format(job.name, self._record_wait(job, 'ok')))
+            job.future.set_result(result)
+        else:
+            job.interval = min(self.max_interval, job.interval * 2)
+            job.next_poll = asyncio.get_running_loop().time() + self._jitter(job.interval)
+
+    def _abandon(self, pending, exception):
+        for job in pending:
+            if job.cancel:
+                try:
+                    job.cancel()
+                except Exception as e:
+                    root_log.error("Failed to cancel job {}: {}".format(job.name, e))
+            if job.future.done():
+                continue
+            if exception is None:
+                job.future.cancel()
+            else:
+                job.future.set_exception(exception)
+        self.jobs = [_ for _ in self.jobs if _ not in pending]
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                self.jobs = [_ for _ in self.jobs if not _.future.done()]
+                if not self.jobs:
+                    return
+                now = loop.time()
+                if now >= deadline:
+                    self._abandon(list(self.jobs), TimeoutError("Job deadline of {}s exceeded".format(self.deadline)))
+                    return
+                if self.stop_event is not None and self.stop_event.is_set():
+                    cancellable = [_ for _ in self.jobs if _.cancel]
+                    if cancellable:
+                        root_log.info("Shutting down, cancelling {} job(s)".format(len(cancellable)))
+                        self._abandon(cancellable, InterruptedError("Job cancelled by shutdown"))
+                        continue
+                due = [_ for _ in self.jobs if _.next_poll <= now]
+                if due:
+                    await asyncio.gather(*[self._poll(_) for _ in due])
+                    continue
+                self._wakeup.clear()
+                wait = min(min(_.next_poll for _ in self.jobs), deadline) - now
+                if self.stop_event is not None and not self.stop_event.is_set():
+                    # the stop event belongs to another thread, look at it at least this often
+                    wait = min(wait, STOP_CHECK_INTERVAL)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            self._abandon([_ for _ in self.jobs if not _.future.done()], None)
+            raise
+        finally:
+            self._wakeup = None
+
+
+def wait_for_jobs(jobs, deadline=None, stop_event=None):
+    """Block until every job completes. Returns results in job order, failed jobs return their exception."""
+    async def _wait():
+        tracker = AsyncJobTracker(deadline=deadline, stop_event=stop_event)
+        futures = [tracker.submit(job) for job in jobs]
+        await tracker.run()
+        return await asyncio.gather(*futures, return_exceptions=True)
+    started = time.monotonic()
+    results = asyncio.run(_wait())
+    root_log.info("Waited {:.1f}s for {} job(s)".format(time.monotonic() - started, len(jobs)))
+    return results
+
+
+def wait_for_job(job, deadline=None, stop_event=None):
+    result, = wait_for_jobs([job], deadline, stop_event)
+    if isinstance(result, BaseException):
+        raise result
+    return result
@@ -0,0 +1,124 @@
+import json
+import logging
+import settings
+import sqlite3
+import threading
+import time
+
+from local_lib.common import process_wide
+
+root_log = logging.getLogger()
+
+NOT_MODIFIED = object()
+
+
+def get_cache(path=None, max_bytes=None, default_ttl=None):
+    """The PersistentCache for a file, the CDD cache by default"""
+    return _get_cache(path or settings.CDD_CACHE_PATH, max_bytes, default_ttl)
+
+
+@process_wide
+def _get_cache(path, max_bytes, default_ttl):
+    return PersistentCache(path, max_bytes, default_ttl)
+
+
+class PersistentCache:
+    """SQLite backed key/value cache with TTLs, ETag revalidation and size bounded LRU eviction"""
+
+    def __init__(self, path, max_bytes=None, default_ttl=None):
+        self.path = path
+        self.max_bytes = max_bytes or settings.CDD_CACHE_MAX_BYTES
+        self.default_ttl = default_ttl or settings.CDD_CACHE_TTL
+        self.stats = {'hits': 0, 'misses': 0, 'revalidated': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS cache_entries (
+                                key TEXT PRIMARY KEY,
+                                value TEXT NOT NULL,
+                                etag TEXT,
+                                expires_at REAL NOT NULL,
+                                last_access REAL NOT NULL,
+                                size INTEGER NOT NULL)""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_entries_last_access ON cache_entries (last_access)")
+
+    def _load(self, key):
+        row = self._conn.execute("SELECT value, etag, expires_at FROM cache_entries WHERE key = ?",
+                                 (key,)).fetchone()
+        if row:
+            self._conn.execute("UPDATE cache_entries SET last_access = ? WHERE key = ?", (time.time(), key))
+        return row
+
+    def get(self, key):
+        with self._lock:
+            row = self._load(key)
+            if row and row[2] > time.time():
+                self.stats['hits'] += 1
+                return json.loads(row[0])
+            self.stats['misses'] += 1
+            return None
+
+    def set(self, key, value, etag=None, ttl=None):
+        encoded = json.dumps(value)
+        if len(encoded) > self.max_bytes:
+            # it would evict everything else and then itself
+            return
+        now = time.time()
+        with self._lock:
+            # named columns, cache files from before the unused modified_at column was dropped still have it
+            self._conn.execute("INSERT OR REPLACE INTO cache_entries (key, value, etag, expires_at, last_access, size) "
+                               "VALUES (?, ?, ?, ?, ?, ?)",
+                               (key, encoded, etag, now + (ttl or self.default_ttl), now, len(encoded)))
+            self._evict()
+
+    def get_or_fetch(self, key, fetch, ttl=None):
+        """
+        Return the cached value for key, calling fetch(etag) on a miss or once the entry has expired.
+        fetch returns NOT_MODIFIED when the server confirms the cached etag (If-None-Match), otherwise
+        (value, etag). Only a NOT_MODIFIED answer counts as revalidated.
+        """
+        with self._lock:
+            row = self._load(key)
+            if row and row[2] > time.time():
+                self.stats['hits'] += 1
+                return json.loads(row[0])
+        result = fetch(row[1] if row else None)
+        if result is NOT_MODIFIED:
+            with self._lock:
+                self.stats['revalidated'] += 1
+                self._conn.execute("UPDATE cache_entries SET expires_at = ? WHERE key = ?",
+                                   (time.time() + (ttl or self.default_ttl), key))
+            return json.loads(row[0])
+        with self._lock:
+            self.stats['misses'] += 1
+        value, etag = result
+        self.set(key, value, etag, ttl)
+        return value
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT key, size FROM cache_entries ORDER BY last_access").fetchall():
+            self._conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+            self.stats['evictions'] += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def invalidate(self, prefix=None):
+        with self._lock:
+            if prefix:
+                cursor = self._conn.execute("DELETE FROM cache_entries WHERE key LIKE ? ESCAPE '\\'",
+                                            (prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%',))
+            else:
+                cursor = self._conn.execute("DELETE FROM cache_entries")
+        root_log.info("Invalidated {} cache entries in {}".format(cursor.rowcount, self.path))
+        return cursor.rowcount
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'], stats['bytes'] = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries").fetchone()
+        return stats
@@ -1,157 +1,258 @@
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, timezone, date
 from local_lib.resources import Protocol
+from local_lib.async_jobs import AsyncJob, wait_for_job, wait_for_jobs
+from local_lib.cache import get_cache, NOT_MODIFIED
+from local_lib.checkpoint import get_checkpoint_store
+from local_lib.metrics import endpoint_label, timed
+from local_lib.molecule_index import get_molecule_index
+from local_lib.multipart import StreamingMultipartEncoder
+from local_lib.paginator import Paginator
+from local_lib.transport import get_transport
+from local_lib.common import ContextThreadPoolExecutor
+from local_lib.json_stream import iter_json_array
 from io import BytesIO, StringIO
 from local_lib.constants import *
 
 import csv
 import json as json_lib
 import logging
-import requests
+import os
 import settings
-import time
+import tempfile
 
 root_log = logging.getLogger()
 
-SLEEP_INTERVAL = 5
+
+def iter_assay_run_csv(assay_run, chunk_size):
+    """Encode the valid files of a run group as CSV, yielding roughly chunk_size bytes at a time"""
+    buffer = StringIO()
+    c = csv.writer(buffer)
+    for i, assay_run_file in enumerate(assay_run):
+        if assay_run_file.valid:
+            for row in assay_run_file.iter_rows(include_header=(i == 0)):
+                c.writerow(row)
+                if buffer.tell() >= chunk_size:
+                    yield buffer.getvalue().encode()
+                    buffer.seek(0)
+                    buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def iter_export_file(path):
+    """Objects of a downloaded export one at a time, the file is removed once they have been read"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            yield from iter_json_array(f, 'objects', settings.CDD_EXPORT_CHUNK_SIZE)
+    finally:
+        os.remove(path)
+
+
+class SlurpWaitError(Exception):
+    """A slurp was submitted but waiting for it failed, it may still be committed"""
+
+    def __init__(self, slurp_id, error):
+        super().__init__("Waiting for slurp {} failed: {}".format(slurp_id, error))
+        self.slurp_id = slurp_id
+
+
+def get_row_run_id(row):
+    run = row.get('run')
+    return run.get('id') if isinstance(run, dict) else run
+
 
 class CddInterface:
-    def __init__(self, key, vault_id, egnyte_interface=None, research_projects=None, dry_run=False):
+    def __init__(self, key, vault_id, egnyte_interface=None, research_projects=None, dry_run=False, transport=None,
+                 cache=None, molecule_index=None, checkpoint_store=None):
         self.key = key
         self.vault_id = vault_id
         self.egnyte_interface = egnyte_interface
         self.mapping_templates = {}
         self.protocols_by_name = {}
         self.protocols_by_id = {}
-        self.max_results_sync = 1000
         self.research_projects = research_projects
         self.dry_run = dry_run
-        self.molecules_by_project = None
+        self.molecule_index = molecule_index or get_molecule_index()
+        self.molecule_index_synced = False
+        self.transport = transport or get_transport()
+        self.cache = cache or get_cache()
+        self.checkpoint_store = checkpoint_store or get_checkpoint_store()
 
-    def _make_request(self, path, method, params=None, files=None, data=None, json=None, sync_only=False, as_json=True):
+    @timed('cdd_request_seconds', lambda self, path, method, *args, **kwargs: {
+        'method': method, 'endpoint': endpoint_label(path)})
+    def _make_request(self, path, method, params=None, files=None, data=None, json=None, as_json=True,
+                      extra_headers=None, stream=False):
         resp = None
         headers = {'X-CDD-Token': self.key}
+        headers.update(extra_headers or {})
         url = "{}/{}/{}".format(settings.CDD_BASE_URL, self.vault_id, path)
         if method == GET:
-            resp = self._handle_get_request(url, headers, params, json, sync_only)
+            resp = self._handle_get_request(url, headers, params, json, stream)
         elif method == POST:
-            resp = requests.post(url, headers=headers, params=params, files=files, data=data)
+            resp = self.transport.request(POST, url, headers=headers, params=params, files=files, data=data)
         elif method == PUT:
-            resp = requests.put(url, headers=headers, params=params, data=data, json=json)
+            resp = self.transport.request(PUT, url, headers=headers, params=params, data=data, json=json)
         elif method == DELETE:
-            resp = requests.delete(url, headers=headers, params=params, data=data, json=json)
+            resp = self.transport.request(DELETE, url, headers=headers, params=params, data=data, json=json)
 
         if resp and resp.status_code == 200:
             return resp.json() if as_json else resp
+        elif resp is not None and resp.status_code == 304:
+            return NOT_MODIFIED
         else:
             raise Exception(resp.content)
 
-    def _handle_get_request(self, url, headers, params, json, sync_only):
-        if params:
-            params['page_size'] = self.max_results_sync
-        if json:
-            json['page_size'] = self.max_results_sync
+    def _handle_get_request(self, url, headers, params, json, stream=False):
         root_log.info("GET: URL: {} Params: {} JSON: {}".format(url, params, json))
-        resp = requests.get(url, headers=headers, params=params, json=json)
-        if resp and resp.status_code == 200:
-            response_objects = resp.json()
-            if not sync_only and response_objects.get('count') and response_objects['count'] >= (self.max_results_sync - 1):
-                root_log.info("Making Async Request. Count = {}".format(response_objects['count']))
-                json["async"] = True
-                resp = requests.get(url, headers=headers, params=params, json=json)
-                if resp and resp.status_code == 200:
-                    async_id = resp.json()['id']
-                    resp = self._handle_async(async_id)
-                else:
-                    raise Exception(resp.content)
-        else:
+        resp = self.transport.request(GET, url, headers=headers, params=params, json=json, stream=stream)
+        if resp.status_code == 304:
+            return resp
+        if not (resp and resp.status_code == 200):
             raise Exception(resp.content)
         return resp
 
+    def _get_listing(self, path, params, json, extra):
+        # list filters go in the JSON body when the caller uses one, otherwise in the query string
+        if json is not None:
+            return self._make_request(path, GET, params=params, json=dict(json, **extra))
+        return self._make_request(path, GET, params=dict(params or {}, **extra))
+
+    def iter_objects(self, path, params=None, json=None, page_size=None):
+        """Paginator over a list endpoint, large results go through an async export"""
+        def fetch_page(offset, size):
+            return self._get_listing(path, params, json, {'offset': offset, 'page_size': size})
+
+        def export():
+            async_id = self._get_listing(path, params, json, {'async': True})['id']
+            return iter_export_file(self._handle_async(async_id))
+        return Paginator(path, fetch_page, export, page_size)
+
+    @timed('cdd_export_seconds')
     def _handle_async(self, async_id):
-        try:
-            while True:
-                response = self._make_request("export_progress/{}".format(async_id), GET)
-                root_log.info("Async Status: {}".format(response['status']))
-                if response['status'] not in CDD_ASYNC_IN_PROGRESS_STATUS:
-                    if response['status'] == FINISHED:
-                        break
-                    else:
-                        raise Exception(response)
-                time.sleep(SLEEP_INTERVAL)
-        except KeyboardInterrupt as e:
+        # a set stop event cancels the export and raises InterruptedError
+        return wait_for_job(self._export_job(async_id))
+
+    def _export_job(self, async_id):
+        def check():
+            response = self._make_request("export_progress/{}".format(async_id), GET)
+            root_log.info("Async Status: {}".format(response['status']))
+            if response['status'] in CDD_ASYNC_IN_PROGRESS_STATUS:
+                return False, None
+            if response['status'] != FINISHED:
+                raise Exception(response)
+            return True, self._download_export(async_id)
+
+        def cancel():
             self._make_request("exports/{}".format(async_id), DELETE)
-            return None
+        return AsyncJob("export {}".format(async_id), check, cancel)
 
-        return self._make_request("exports/{}".format(async_id), GET, sync_only=True, as_json=False)
+    def _download_export(self, async_id):
+        """Spool the export to a temp file in chunks instead of holding the whole response"""
+        resp = self._make_request("exports/{}".format(async_id), GET, as_json=False, stream=True)
+        f = tempfile.NamedTemporaryFile(prefix='cdd_export_', suffix='.json', delete=False)
+        try:
+            with f:
+                for chunk in resp.iter_content(settings.CDD_EXPORT_CHUNK_SIZE):
+                    f.write(chunk)
+        except BaseException:
+            os.remove(f.name)
+            raise
+        finally:
+            resp.close()
+        return f.name
 
-    def _get_molecules_by_project(self, created_after=None):
-        self.molecules_by_project = {}
-        for project_name in self.research_projects['research_projects'].keys():
+    def _sync_molecule_index(self):
+        """Refresh the molecule index with every batch modified since the last sync, whatever its project"""
+        with self.molecule_index.sync_lock:
+            synced_at = date.today().isoformat()
+            modified_after = self.molecule_index.get_watermark(self.vault_id) or self.molecule_index.window_start()
             params = {
                 "molecule_fields": ['ID'],
                 "batch_fields": [settings.CDD_PROJECT_NAME_LABEL],
                 "no_structures": "true",
-                "fields_search": [{"name": settings.CDD_PROJECT_NAME_LABEL,
-                                  "text_value": project_name}]
+                "modified_after": modified_after
             }
-            if created_after:
-                params['created_after'] = created_after
-
-            batches = self.get_batches(params)
-            if batches:
-                for batch in batches:
-                    self.molecules_by_project.setdefault(batch['batch_fields'][settings.CDD_PROJECT_NAME_LABEL],
-                                                         set()).add(batch['molecule']['id'])
+            self.molecule_index.update(self.vault_id, self.get_batches(params), synced_at)
+        self.molecule_index_synced = True
 
     def get_molecules(self, json):
-        resp = self._make_request("molecules", GET, json=json)
-        if resp:
-            return resp['objects']
+        return self.iter_objects("molecules", json=json)
 
     def get_batches(self, json):
-        resp = self._make_request("batches", GET, json=json)
-        if resp:
-            return resp['objects']
+        return self.iter_objects("batches", json=json)
 
     def get_readout_rows(self, json):
-        resp = self._make_request("readout_rows", GET, json=json)
-        if resp:
-            return resp['objects']
+        return self.iter_objects("readout_rows", json=json)
 
     def update_batch(self, batch_id, json):
         resp = self._make_request('batches/{}'.format(batch_id), PUT, json=json)
         root_log.info(str(resp))
 
+    def _get_cached(self, cache_key, path, params=None):
+        def fetch(etag):
+            extra_headers = {'If-None-Match': etag} if etag else None
+            resp = self._make_request(path, GET, params=params, as_json=False, extra_headers=extra_headers)
+            if resp is NOT_MODIFIED:
+                return resp
+            return resp.json(), resp.headers.get('ETag')
+        return self.cache.get_or_fetch("{}:{}".format(self.vault_id, cache_key), fetch)
+
     def get_mapping_template(self, mapping_template_id):
         if not self.mapping_templates.get(mapping_template_id):
-            resp = self._make_request("mapping_templates/{}".format(mapping_template_id), GET)
+            resp = self._get_cached("mapping_template:{}".format(mapping_template_id),
+                                    "mapping_templates/{}".format(mapping_template_id))
             self.mapping_templates[mapping_template_id] = resp
         return self.mapping_templates[mapping_template_id]
 
     def get_protocol_by_name(self, protocol_name):
         if not self.protocols_by_name.get(protocol_name):
-            resp = self._make_request("protocols", GET, params={'names': protocol_name})
+            resp = self._get_cached("protocol:{}".format(protocol_name), "protocols", params={'names': protocol_name})
             if resp['count'] != 1:
                 raise Exception("found multiple protocols: Name: {} Count: {}".format(protocol_name, resp['count']))
             self.protocols_by_name[protocol_name] = Protocol(resp['objects'][0])
         return self.protocols_by_name[protocol_name]
 
+    def reset_run_state(self):
+        """Clear templates and protocols memoized by the previous run, the persistent cache still backs them"""
+        self.mapping_templates = {}
+        self.protocols_by_name = {}
+        self.protocols_by_id = {}
+        self.molecule_index_synced = False
+
     def set_run_fields(self, run_id, data):
         resp = self._make_request("runs/{}".format(run_id), PUT, json=data)
         return resp
 
+    def _runs_watermark_name(self):
+        return "cdd_runs_modified_after:{}:{}".format(self.vault_id, ",".join(sorted(self.research_projects or {})))
+
+    def iter_unprocessed_runs(self, runs_modified_after):
+        """(protocol, run) for every uploaded run not yet marked as processed, filtered page by page"""
+        params = {'runs_modified_after': runs_modified_after}
+        for protocol in self.iter_objects('protocols', params, page_size=settings.CDD_PROTOCOL_PAGE_SIZE):
+            for run in protocol.get('runs') or []:
+                if run.get(CDD_LOAD_PROCESSED_FIELD) != 'Yes' and run.get(CDD_INTEGRATION_ID_FIELD):
+                    yield protocol, run
+
     def process_runs(self):
+        self.reset_run_state()
+        if self.egnyte_interface:
+            self.egnyte_interface.invalidate_metadata()
+            self.egnyte_interface.replay_metadata()
         has_data = {}
-        runs_modified_after = (datetime.now() - timedelta(days=1)).isoformat()
-        params = {'runs_modified_after': runs_modified_after, 'page_size': 1000}
-        response = self._make_request('protocols', GET, params)
-        for response_object in response['objects']:
-            assay_name = response_object['name']
-            for run in response_object['runs']:
-                print(run)
-                if run.get(CDD_LOAD_PROCESSED_FIELD) == 'Yes' or not run.get(CDD_INTEGRATION_ID_FIELD):
-                    continue
+        unattributed_runs = {}
+        # the next pass starts a margin before this one started, in UTC, so runs modified meanwhile or stamped by a
+        # skewed server clock are not missed; runs seen twice are skipped as already processed
+        started_at = datetime.now(timezone.utc)
+        next_modified_after = (started_at - timedelta(seconds=settings.CDD_RUNS_WATERMARK_OVERLAP)).isoformat()
+        runs_modified_after = self.checkpoint_store.get_cursor(self._runs_watermark_name()) or \
+            (started_at - timedelta(days=settings.CDD_RUNS_INITIAL_WINDOW_DAYS)).isoformat()
+        root_log.info("Processing runs modified after {}".format(runs_modified_after))
+        try:
+            for response_object, run in self.iter_unprocessed_runs(runs_modified_after):
+                assay_name = response_object['name']
                 if not self.dry_run:
+                    # the Success statuses are journaled before the run is marked, so they survive a crash
                     if run.get(CDD_INTEGRATION_ID_FIELD):
                         self.upload_run_attachment(run['id'], run[CDD_INTEGRATION_ID_FIELD], True)
                     self.set_run_fields(run['id'], {CDD_LOAD_PROCESSED_FIELD: 'Yes'})
@@ -159,36 +260,74 @@ class CddInterface:
                     has_data.setdefault(response_object['protocol_fields'].get(settings.CDD_PROJECT_NAME_LABEL), dict())[assay_name] = True
 
                 elif not response_object['protocol_fields'].get(settings.CDD_PROJECT_NAME_LABEL):
-                    projects = self._check_for_project_molecules_in_run(run['id'])
-                    for project in projects:
-                        has_data.setdefault(project, dict())[assay_name] = True
+                    unattributed_runs[run['id']] = assay_name
+        finally:
+            if self.egnyte_interface:
+                try:
+                    self.egnyte_interface.flush_metadata()
+                except Exception as e:
+                    # the statuses stay journaled and are replayed by the next run, the runs already marked
+                    # must still get their Teams post and move the watermark
+                    root_log.error("Flushing the Success statuses failed: {}".format(e))
+        if unattributed_runs:
+            for run_id, projects in self._get_projects_by_run(list(unattributed_runs.keys())).items():
+                for project in projects:
+                    has_data.setdefault(project, dict())[unattributed_runs[run_id]] = True
         self._post_to_teams(has_data)
+        if not self.dry_run:
+            self.checkpoint_store.set_cursor(self._runs_watermark_name(), next_modified_after)
         return has_data
 
-    def _check_for_project_molecules_in_run(self, run_id):
-        projects = []
-        if self.molecules_by_project is None:
-            self._get_molecules_by_project(created_after=(datetime.now() - timedelta(days=120)).date().isoformat())
-        rows = self.get_readout_rows(json={'runs': str(run_id), 'type': 'detail_row'})
-        molecules = {_.get('molecule') for _ in rows}
-        for project_name, project_molecules in self.molecules_by_project.items():
-            if project_molecules.intersection(molecules):
-                projects.append(project_name)
-        return projects
+    def _get_projects_by_run(self, run_ids):
+        if not self.molecule_index_synced:
+            self._sync_molecule_index()
+        molecules_by_run = {run_id: set() for run_id in run_ids}
+        batch_size = settings.CDD_READOUT_ROW_RUN_BATCH_SIZE
+        for i in range(0, len(run_ids), batch_size):
+            run_id_batch = run_ids[i:i + batch_size]
+            rows = list(self.get_readout_rows(json={'runs': ",".join(str(_) for _ in run_id_batch), 'type': 'detail_row'}))
+            if len(run_id_batch) > 1 and any(get_row_run_id(row) is None for row in rows):
+                # rows without a run reference cannot be grouped, fetch this batch one run at a time
+                rows = [dict(row, run=run_id) for run_id in run_id_batch
+                        for row in self.get_readout_rows(json={'runs': str(run_id), 'type': 'detail_row'})]
+            for row in rows:
+                run_id = get_row_run_id(row) if len(run_id_batch) > 1 else run_id_batch[0]
+                if run_id in molecules_by_run:
+                    molecules_by_run[run_id].add(row.get('molecule'))
+        return {run_id: self.molecule_index.projects_for_molecules(self.vault_id, molecules, self.research_projects)
+                for run_id, molecules in molecules_by_run.items()}
 
+    @timed('cdd_upload_seconds')
     def _upload_data(self, files, data):
-        root_log.info("Uploading File: {}, Data: {}".format(files, str(data)))
-        resp = self._make_request('slurps', POST, data={'json': json_lib.dumps(data)}, files=files)
-        slurp_id = resp["id"]
-        state = resp["state"]
-
-        while state not in CDD_SLURP_IN_PROGRESS_STATUS:
-            time.sleep(SLEEP_INTERVAL)
-            slurp_resp = self._make_request("slurps/{}".format(slurp_id), GET)
-            state = slurp_resp["state"]
-            root_log.info("Slurp {} State {}".format(slurp_id, state))
+        slurp_id, state = self._submit_slurp(files, data)
+        if state not in CDD_SLURP_IN_PROGRESS_STATUS:
+            try:
+                wait_for_job(self._slurp_job(slurp_id))
+            except Exception as e:
+                raise SlurpWaitError(slurp_id, e) from e
         return slurp_id
 
+    def _submit_slurp(self, files, data):
+        root_log.info("Uploading File: {}, Data: {}".format(files, str(data)))
+        resp = self._post_multipart('slurps', {'json': json_lib.dumps(data)}, files)
+        return resp["id"], resp["state"]
+
+    def _post_multipart(self, path, fields, files, measure_unsized=True):
+        if not any(callable(_[1]) for _ in files.values()):
+            return self._make_request(path, POST, data=fields, files=files)
+        body = StreamingMultipartEncoder(fields, files, measure_unsized)
+        return self._make_request(path, POST, data=body, extra_headers={'Content-Type': body.content_type})
+
+    def get_slurp_state(self, slurp_id):
+        slurp_resp = self._make_request("slurps/{}".format(slurp_id), GET)
+        root_log.info("Slurp {} State {}".format(slurp_id, slurp_resp["state"]))
+        return slurp_resp["state"]
+
+    def _slurp_job(self, slurp_id):
+        def check():
+            return self.get_slurp_state(slurp_id) in CDD_SLURP_IN_PROGRESS_STATUS, slurp_id
+        return AsyncJob("slurp {}".format(slurp_id), check)
+
     def _post_to_teams(self, data):
         for project_id, assays_dict in data.items():
             assay_list = sorted(assays_dict.keys())
@@ -235,10 +374,10 @@ class CddInterface:
                 ]
             }
             if not self.dry_run:
-                r = requests.post(project_data['webhook_url'], json=card)
+                r = self.transport.request(POST, project_data['webhook_url'], json=card)
                 root_log.info("Teams Post: {}, {}".format(project_id, r.content))
 
-    def upload_assay_run(self, assay_run, project_id, mapping_template_id, integration_uuid, assay_run_csv_name):
+    def _build_assay_run_upload(self, assay_run, project_id, mapping_template_id, integration_uuid, assay_run_csv_name):
         data = {
             'project': project_id,
             'autoreject': False,
@@ -247,40 +386,72 @@ class CddInterface:
                 'conditions': integration_uuid,
             }
         }
-        files = {}
-        assay_file_stream = StringIO()
-        c = csv.writer(assay_file_stream)
-        has_valid_files = False
-        for i, assay_run_file in enumerate(assay_run):
-            if assay_run_file.valid:
-                processed_assay_run_array = assay_run_file.data_array
-                if i != 0:
-                    processed_assay_run_array = assay_run_file.data_array[1:]
-                c.writerows(processed_assay_run_array)
-                has_valid_files = True
-        if has_valid_files:
-            assay_file_stream.seek(0)
-            files['file'] = (assay_run_csv_name, assay_file_stream)
-            slurp_id = self._upload_data(files, data)
+        if any(assay_run_file.valid for assay_run_file in assay_run):
+            csv_chunks = lambda: iter_assay_run_csv(assay_run, settings.CDD_UPLOAD_CHUNK_SIZE)
+            if not settings.CDD_STREAMING_UPLOAD:
+                csv_chunks = BytesIO(b"".join(csv_chunks()))
+            return {'file': (assay_run_csv_name, csv_chunks, 'text/csv')}, data
+
+    def upload_assay_run(self, assay_run, project_id, mapping_template_id, integration_uuid, assay_run_csv_name):
+        upload = self._build_assay_run_upload(assay_run, project_id, mapping_template_id, integration_uuid, assay_run_csv_name)
+        if upload:
+            slurp_id = self._upload_data(*upload)
             return slurp_id
 
+    def upload_assay_runs(self, uploads):
+        """
+        Submit the slurps for several independent run groups concurrently and wait for them together.
+        uploads is a list of upload_assay_run argument tuples. Returns the slurp id (or None when the group
+        had no valid files) per upload, or the exception raised for that upload; a SlurpWaitError when the slurp
+        was submitted but waiting for it failed.
+        """
+        def submit(upload_args):
+            upload = self._build_assay_run_upload(*upload_args)
+            return self._submit_slurp(*upload) if upload else (None, None)
+
+        with ContextThreadPoolExecutor(max_workers=settings.CDD_UPLOAD_CONCURRENCY) as pool:
+            futures = [pool.submit(submit, _) for _ in uploads]
+        results = []
+        jobs = {}
+        for idx, future in enumerate(futures):
+            try:
+                slurp_id, state = future.result()
+            except Exception as e:
+                results.append(e)
+                continue
+            results.append(slurp_id)
+            if slurp_id and state not in CDD_SLURP_IN_PROGRESS_STATUS:
+                jobs[idx] = self._slurp_job(slurp_id)
+        for idx, result in zip(jobs.keys(), wait_for_jobs(list(jobs.values()))):
+            if isinstance(result, BaseException):
+                results[idx] = SlurpWaitError(results[idx], result)
+        return results
+
     def upload_run_attachment(self, run_id, integration_id, set_egnyte_status_complete):
         assay_run_files = self.egnyte_interface.get_files_by_integration_id(integration_id)
         if assay_run_files:
-            for run_file, filename, group_id in assay_run_files:
-                files = {'file': ("Source - " + filename, run_file)}
-
-                data = {'resource_class': 'run',
-                        'resource_id': run_id}
-                self._make_request('files', POST, data=data, files=files)
-                if set_egnyte_status_complete:
-                    metadata = {
-                        EGNYTE_FILE_CDD_STATUS: 'Success'
-                    }
-                    self.egnyte_interface.set_metadata(metadata, group_id, EGNYTE_CDD_SECTION_KEY)
+            with ContextThreadPoolExecutor(max_workers=settings.CDD_ATTACHMENT_CONCURRENCY) as pool:
+                futures = [pool.submit(self._upload_run_file, run_id, run_file, set_egnyte_status_complete)
+                           for run_file in assay_run_files]
+            for future in futures:
+                future.result()
         else:
             print("no files for: {}".format(integration_id))
 
+    def _upload_run_file(self, run_id, run_file, set_egnyte_status_complete):
+        file_stream, filename, group_id, size = run_file
+        files = {'file': ("Source - " + filename, file_stream, None, size)}
+
+        data = {'resource_class': 'run',
+                'resource_id': run_id}
+        # never download a file twice just to measure it
+        self._post_multipart('files', data, files, measure_unsized=False)
+        if set_egnyte_status_complete:
+            metadata = {
+                EGNYTE_FILE_CDD_STATUS: 'Success'
+            }
+            self.egnyte_interface.queue_metadata(metadata, group_id, EGNYTE_CDD_SECTION_KEY)
+
     def validate_and_group_file_arrays(self, assay_run_file_array, mapping_template_id):
         mapping_template = self.get_mapping_template(mapping_template_id)
         for header in mapping_template['header_mappings']:
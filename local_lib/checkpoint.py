@@ -0,0 +1,175 @@
+import json
+import logging
+import settings
+import sqlite3
+import threading
+import time
+
+from local_lib.common import process_wide
+
+root_log = logging.getLogger()
+
+
+@process_wide
+def get_checkpoint_store():
+    return CheckpointStore()
+
+
+def read_last_line(file_name):
+    """Last non empty line of a legacy append-only lock file, read from the end of the file"""
+    try:
+        f = open(file_name, 'rb')
+    except FileNotFoundError:
+        return None
+    with f:
+        f.seek(0, 2)
+        position = f.tell()
+        tail = b""
+        while position > 0 and not tail.strip(b"\n").count(b"\n"):
+            step = min(4096, position)
+            position -= step
+            f.seek(position)
+            tail = f.read(step) + tail
+        lines = [_ for _ in tail.splitlines() if _.strip()]
+        return lines[-1].decode().strip() if lines else None
+
+
+class CheckpointStore:
+    """
+    SQLite (WAL) store for event cursors, the target paths/entry ids already processed, the target paths whose upload
+    failed, the slurps whose outcome is still unknown and the metadata journal
+    """
+
+    def __init__(self, path=None, retention_days=None):
+        self.path = path or settings.CHECKPOINT_PATH
+        self.retention_days = retention_days or settings.CHECKPOINT_RETENTION_DAYS
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS cursors (
+                                name TEXT PRIMARY KEY,
+                                value TEXT NOT NULL,
+                                updated_at REAL NOT NULL)""")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS processed_entries (
+                                scope TEXT NOT NULL,
+                                target_path TEXT NOT NULL,
+                                entry_id TEXT NOT NULL,
+                                processed_at REAL NOT NULL,
+                                PRIMARY KEY (scope, target_path, entry_id))""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS processed_entries_processed_at ON processed_entries (processed_at)")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS metadata_journal (
+                                scope TEXT NOT NULL,
+                                group_id TEXT NOT NULL,
+                                namespace TEXT NOT NULL,
+                                data TEXT NOT NULL,
+                                owner TEXT NOT NULL,
+                                queued_at REAL NOT NULL,
+                                PRIMARY KEY (scope, group_id, namespace))""")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS pending_slurps (
+                                scope TEXT NOT NULL,
+                                slurp_id TEXT NOT NULL,
+                                data TEXT NOT NULL,
+                                submitted_at REAL NOT NULL,
+                                PRIMARY KEY (scope, slurp_id))""")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS failed_paths (
+                                scope TEXT NOT NULL,
+                                target_path TEXT NOT NULL,
+                                failed_at REAL NOT NULL,
+                                PRIMARY KEY (scope, target_path))""")
+
+    def get_cursor(self, name):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM cursors WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_cursor(self, name, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO cursors VALUES (?, ?, ?)", (name, str(value), time.time()))
+
+    def is_processed(self, scope, target_path, entry_id):
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM processed_entries WHERE scope = ? AND target_path = ? AND entry_id = ?",
+                                     (scope, target_path, str(entry_id))).fetchone()
+        return row is not None
+
+    def mark_processed(self, scope, target_path, entry_id):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO processed_entries VALUES (?, ?, ?, ?)",
+                               (scope, target_path, str(entry_id), time.time()))
+
+    def mark_failed(self, scope, target_path):
+        """Record a target path whose upload failed, it is retried by the next run whatever the event cursor says"""
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO failed_paths VALUES (?, ?, ?)", (scope, target_path, time.time()))
+
+    def get_failed(self, scope):
+        with self._lock:
+            rows = self._conn.execute("SELECT target_path FROM failed_paths WHERE scope = ? ORDER BY failed_at",
+                                      (scope,)).fetchall()
+        return [_[0] for _ in rows]
+
+    def clear_failed(self, scope, target_paths):
+        with self._lock:
+            self._conn.executemany("DELETE FROM failed_paths WHERE scope = ? AND target_path = ?",
+                                   [(scope, _) for _ in target_paths])
+
+    def add_pending_slurp(self, scope, slurp_id, data):
+        """Record a submitted slurp whose outcome is not known yet, with what is needed to finish its files later"""
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO pending_slurps VALUES (?, ?, ?, ?)",
+                               (scope, str(slurp_id), json.dumps(data), time.time()))
+
+    def get_pending_slurps(self, scope):
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM pending_slurps WHERE scope = ? ORDER BY submitted_at",
+                                      (scope,)).fetchall()
+        return [json.loads(_[0]) for _ in rows]
+
+    def clear_pending_slurp(self, scope, slurp_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM pending_slurps WHERE scope = ? AND slurp_id = ?", (scope, str(slurp_id)))
+
+    def journal_metadata(self, scope, group_id, namespace, data, owner):
+        """
+        Record a metadata write before it is sent, merged into any write still pending for the same file.
+        Returns its queued_at, which increases with every merge and is the version clear_metadata() checks.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT data, queued_at FROM metadata_journal WHERE scope = ? AND group_id = ? AND namespace = ?",
+                                     (scope, group_id, namespace)).fetchone()
+            merged = dict(json.loads(row[0]), **data) if row else data
+            queued_at = max(time.time(), row[1] + 1e-6) if row else time.time()
+            self._conn.execute("INSERT OR REPLACE INTO metadata_journal VALUES (?, ?, ?, ?, ?, ?)",
+                               (scope, group_id, namespace, json.dumps(merged, sort_keys=True), owner, queued_at))
+        return queued_at
+
+    def clear_metadata(self, scope, group_id, namespace, queued_at):
+        """Drop a journaled write once it is sent, unless a newer one was merged into it meanwhile"""
+        with self._lock:
+            self._conn.execute("DELETE FROM metadata_journal WHERE scope = ? AND group_id = ? AND namespace = ? AND queued_at <= ?",
+                               (scope, group_id, namespace, queued_at))
+
+    def release_metadata(self, scope, group_id, namespace):
+        with self._lock:
+            self._conn.execute("UPDATE metadata_journal SET owner = '' WHERE scope = ? AND group_id = ? AND namespace = ?",
+                               (scope, group_id, namespace))
+
+    def claim_metadata(self, scope, owner):
+        """Take over the journaled writes left by other processes or released after a failure"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            rows = self._conn.execute("SELECT group_id, namespace, data, queued_at FROM metadata_journal WHERE scope = ? AND owner != ?",
+                                      (scope, owner)).fetchall()
+            self._conn.execute("UPDATE metadata_journal SET owner = ? WHERE scope = ? AND owner != ?", (owner, scope, owner))
+            self._conn.execute("COMMIT")
+        return [(group_id, namespace, json.loads(data), queued_at) for group_id, namespace, data, queued_at in rows]
+
+    def compact(self):
+        cutoff = time.time() - self.retention_days * 24 * 60 * 60
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM processed_entries WHERE processed_at < ?", (cutoff,)).rowcount
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        if deleted:
+            root_log.info("Checkpoint store: compacted {} processed entries".format(deleted))
+        return deleted
@@ -1,10 +1,46 @@
+import contextvars
+import functools
 import logging
 import smtplib
 import sys
+import threading
 
+from concurrent.futures import ThreadPoolExecutor
 from email.message import EmailMessage
 from io import StringIO
 
+log_context = contextvars.ContextVar('log_context', default=None)
+
+
+class LogContextFilter(logging.Filter):
+    """Adds the current log_context (e.g. the project being processed) to every record"""
+
+    def filter(self, record):
+        context = log_context.get()
+        record.log_context = "[{}] ".format(context) if context else ""
+        return True
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor whose tasks run in a copy of the submitter's context, so worker log lines keep the log_context"""
+
+    def submit(self, fn, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def process_wide(factory):
+    """Decorator for a getter that creates its instance once per argument tuple and then shares it for the process"""
+    instances = {}
+    lock = threading.Lock()
+
+    @functools.wraps(factory)
+    def get(*args):
+        with lock:
+            if args not in instances:
+                instances[args] = factory(*args)
+            return instances[args]
+    return get
+
 
 def set_up_logging():
 
@@ -24,8 +60,9 @@ def set_up_logging():
     root_log.setLevel(logging.DEBUG)
     handler = logging.StreamHandler(log_stream)
     handler.setLevel(logging.INFO)
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(log_context)s%(message)s')
     handler.setFormatter(formatter)
+    handler.addFilter(LogContextFilter())
     root_log.addHandler(handler)
 
     handler.setStream(sys.stdout)
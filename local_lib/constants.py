@@ -15,6 +15,7 @@ EGNYTE_FILE_CDD_STATUS = 'status'
 EGNYTE_FILE_CDD_STATUS_SUCCESS = 'Success'
 EGNYTE_FILE_CDD_STATUS_FAILED = 'Failed'
 EGNYTE_FILE_CDD_STATUS_PROCESSING = 'Processing'
+EGNYTE_FILE_CDD_STATUS_DUPLICATE = 'Duplicate'
 
 
 CDD_LOAD_PROCESSED_FIELD = 'place'
@@ -26,4 +27,15 @@ FINISHED = "finished"
 
 CDD_ASYNC_IN_PROGRESS_STATUS = [NEW, STARTED]
 
-CDD_SLURP_IN_PROGRESS_STATUS = ["committed", "canceled", "rejected", "invalid"]
\ No newline at end of file
+CDD_SLURP_IN_PROGRESS_STATUS = ["committed", "canceled", "rejected", "invalid"]
+CDD_SLURP_COMMITTED = "committed"
+
+IDEMPOTENT_METHODS = [GET, PUT, DELETE]
+
+RETRY_STATUS_CODES = [500, 502, 503, 504]
+
+EGNYTE_THROTTLE_ERROR_CODES = ['ERR_403_DEVELOPER_OVER_QPS', 'ERR_403_DEVELOPER_OVER_RATE']
+
+RATE_LIMIT_MIN_FRACTION = 0.1
+RATE_LIMIT_RECOVERY_STEP = 0.05
+RATE_LIMIT_QUOTA_WARNING = 0.9
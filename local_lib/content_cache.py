@@ -0,0 +1,56 @@
+import logging
+import settings
+
+from local_lib.cache import get_cache
+from local_lib.common import process_wide
+
+root_log = logging.getLogger()
+
+
+@process_wide
+def get_content_cache():
+    return ContentCache(get_cache(settings.ASSAY_CONTENT_CACHE_PATH, settings.ASSAY_CONTENT_CACHE_MAX_BYTES,
+                                  settings.ASSAY_CONTENT_CACHE_TTL))
+
+
+def _cell(value):
+    # dates and times are written to the upload csv as str() anyway
+    return value if value is None or isinstance(value, (str, int, float)) else str(value)
+
+
+def normalize_data_array(data_array):
+    """Parsed raw data array with the cell types a cached one has, so run keys match whether it was cached or not"""
+    return [[_cell(_) for _ in row] for row in data_array]
+
+
+class ContentCache:
+    """
+    Assay workbooks keyed by the Egnyte file checksum (sha512 of the bytes): the parsed raw data array,
+    so unchanged or copied files are not downloaded and parsed again, and the slurp each one went up in,
+    so the same data is never uploaded twice to a project and mapping template.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def get_parsed(self, checksum):
+        return self.cache.get("parsed:{}".format(checksum)) if checksum else None
+
+    def set_parsed(self, checksum, data_array):
+        """Cache a freshly parsed array, returned normalized like get_parsed() returns it"""
+        data_array = normalize_data_array(data_array)
+        if checksum:
+            self.cache.set("parsed:{}".format(checksum), data_array)
+        return data_array
+
+    def get_upload(self, checksum, project_id, mapping_template_id):
+        if checksum:
+            return self.cache.get("upload:{}:{}:{}".format(project_id, mapping_template_id, checksum))
+
+    def set_upload(self, checksum, project_id, mapping_template_id, slurp_id, integration_id, source_path=None):
+        if checksum:
+            self.cache.set("upload:{}:{}:{}".format(project_id, mapping_template_id, checksum),
+                           {'slurp_id': slurp_id, 'integration_id': integration_id, 'source_path': source_path})
+
+    def get_stats(self):
+        return self.cache.get_stats()
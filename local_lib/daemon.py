@@ -0,0 +1,202 @@
+import json
+import logging
+import settings
+import signal
+import threading
+import time
+import traceback
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from local_lib.async_jobs import set_stop_event
+
+root_log = logging.getLogger()
+
+
+class ScheduledTask:
+    """
+    Runs func every interval seconds on its own thread.
+    A trigger that arrives while the task is running or already due is coalesced into that single next run,
+    and the next interval is counted from the end of a run so a slow run never stacks up behind itself.
+    """
+
+    def __init__(self, name, func, interval):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.next_run = time.monotonic()
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.coalesced = 0
+        self.last_started = None
+        self.last_finished = None
+        self.last_success = None
+        self.last_duration = None
+        self.last_error = None
+        self._trigger = threading.Event()
+        self._thread = None
+
+    def trigger(self):
+        if self._trigger.is_set() or (not self.running and self.next_run <= time.monotonic()):
+            self.coalesced += 1
+        self._trigger.set()
+
+    def wake(self):
+        self._trigger.set()
+
+    def _run(self):
+        self.running = True
+        self.last_started = time.time()
+        started = time.monotonic()
+        try:
+            self.func()
+        except Exception as e:
+            self.failures += 1
+            self.last_error = "{}: {}".format(type(e).__name__, e)
+            root_log.error("Task {} failed: {}".format(self.name, traceback.format_exc()))
+        else:
+            self.last_error = None
+            self.last_success = time.time()
+        finally:
+            self.runs += 1
+            self.running = False
+            self.last_finished = time.time()
+            self.last_duration = time.monotonic() - started
+            root_log.info("Task {} finished in {:.1f}s".format(self.name, self.last_duration))
+
+    def _loop(self, stopping):
+        while not stopping.is_set():
+            self._trigger.wait(max(0, self.next_run - time.monotonic()))
+            if stopping.is_set():
+                return
+            self._trigger.clear()
+            self._run()
+            self.next_run = time.monotonic() + self.interval
+
+    def start(self, stopping):
+        self._thread = threading.Thread(target=self._loop, args=(stopping,), name=self.name, daemon=True)
+        self._thread.start()
+
+    def join(self, timeout=None):
+        if self._thread:
+            self._thread.join(timeout)
+        return not (self._thread and self._thread.is_alive())
+
+    def is_healthy(self):
+        if self.last_error:
+            return False
+        # a run that is overdue by more than two intervals means the task is stuck
+        last = self.last_success or self.last_started
+        return last is None or self.running or time.time() - last < 3 * self.interval
+
+    def get_status(self):
+        return {
+            'interval': self.interval,
+            'running': self.running,
+            'healthy': self.is_healthy(),
+            'runs': self.runs,
+            'failures': self.failures,
+            'coalesced_triggers': self.coalesced,
+            'last_started': self.last_started,
+            'last_finished': self.last_finished,
+            'last_success': self.last_success,
+            'last_duration': self.last_duration,
+            'last_error': self.last_error,
+            'next_run_in': None if self.running else max(0, self.next_run - time.monotonic()),
+        }
+
+
+class Daemon:
+    """Runs ScheduledTasks until SIGINT/SIGTERM and serves their status on a localhost HTTP endpoint"""
+
+    def __init__(self, tasks, health_host=None, health_port=None, shutdown_timeout=None, extra_status=None):
+        self.tasks = {_.name: _ for _ in tasks}
+        self.health_host = health_host or settings.DAEMON_HEALTH_HOST
+        self.health_port = settings.DAEMON_HEALTH_PORT if health_port is None else health_port
+        self.shutdown_timeout = shutdown_timeout or settings.DAEMON_SHUTDOWN_TIMEOUT
+        self.extra_status = extra_status
+        self.started = None
+        self.stopping = threading.Event()
+        self.server = None
+
+    def get_status(self):
+        tasks = {name: task.get_status() for name, task in self.tasks.items()}
+        status = {
+            'status': 'ok' if all(_['healthy'] for _ in tasks.values()) else 'failing',
+            'stopping': self.stopping.is_set(),
+            'uptime': time.time() - self.started if self.started else 0,
+            'tasks': tasks,
+        }
+        if self.extra_status:
+            status.update(self.extra_status())
+        return status
+
+    def trigger(self, name):
+        self.tasks[name].trigger()
+
+    def _make_handler(self):
+        daemon = self
+
+        class HealthHandler(BaseHTTPRequestHandler):
+
+            def _send(self, code, body):
+                data = json.dumps(body, default=str).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path.rstrip('/') not in ('', '/health', '/status'):
+                    return self._send(404, {'error': 'not found'})
+                status = daemon.get_status()
+                self._send(200 if status['status'] == 'ok' else 503, status)
+
+            def do_POST(self):
+                name = self.path.strip('/').split('/', 1)[-1]
+                if not self.path.startswith('/trigger/') or name not in daemon.tasks:
+                    return self._send(404, {'error': 'unknown task'})
+                daemon.trigger(name)
+                self._send(202, daemon.tasks[name].get_status())
+
+            def log_message(self, format, *args):
+                root_log.debug("Health endpoint: " + format % args)
+
+        return HealthHandler
+
+    def start(self):
+        self.started = time.time()
+        # long CDD export waits are cancelled on shutdown instead of outliving it
+        set_stop_event(self.stopping)
+        for task in self.tasks.values():
+            task.start(self.stopping)
+        if self.health_port is not None:
+            self.server = ThreadingHTTPServer((self.health_host, self.health_port), self._make_handler())
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, name='health', daemon=True).start()
+            root_log.info("Health endpoint on http://{}:{}/health".format(*self.server.server_address[:2]))
+
+    def stop(self, signum=None, frame=None):
+        if signum is not None:
+            root_log.info("Received signal {}, shutting down after the running tasks finish".format(signum))
+        self.stopping.set()
+        for task in self.tasks.values():
+            task.wake()
+
+    def run(self):
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self.stop)
+        self.start()
+        try:
+            while not self.stopping.wait(1):
+                pass
+        finally:
+            deadline = time.monotonic() + self.shutdown_timeout
+            for task in self.tasks.values():
+                if not task.join(max(0, deadline - time.monotonic())):
+                    root_log.error("Task {} still running after {}s, abandoning it".format(task.name, self.shutdown_timeout))
+            if self.server:
+                self.server.shutdown()
+                self.server.server_close()
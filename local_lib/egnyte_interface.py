@@ -1,18 +1,40 @@
 import datetime
 import logging
 import egnyte
+import multiprocessing
 import openpyxl
+import os
 import pathlib
-import requests
+import settings
+import tempfile
+import threading
 import time
 import uuid
 
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
 from io import BytesIO, StringIO
-from urllib.parse import quote
+from urllib.parse import quote, urlsplit
+from local_lib.cdd_interface import SlurpWaitError
 from local_lib.constants import *
+from local_lib.checkpoint import get_checkpoint_store, read_last_line
+from local_lib.common import ContextThreadPoolExecutor
+from local_lib.content_cache import get_content_cache
+from local_lib.event_reader import EventReader
+from local_lib.metadata_writer import MetadataWriter
+from local_lib.metrics import endpoint_label, get_metrics, timed
 from local_lib.resources import AssayRunFile
+from local_lib.transport import get_transport
 root_log = logging.getLogger()
 
+_cursor_locks = {}
+_cursor_locks_lock = threading.Lock()
+
+
+def get_cursor_lock(cursor_name):
+    """Projects syncing the same domain share one event cursor, their syncs take turns on this lock"""
+    with _cursor_locks_lock:
+        return _cursor_locks.setdefault(cursor_name, threading.Lock())
+
 
 def find_raw_data_sheet(wb, name):
     for name in RAW_DATA_SHEET_NAMES:
@@ -21,6 +43,60 @@ def find_raw_data_sheet(wb, name):
     raise Exception("Cannot find data sheet for: {}".format(name))
 
 
+def open_download(source):
+    return BytesIO(source) if isinstance(source, bytes) else open(source, 'rb')
+
+
+def release_download(source):
+    if isinstance(source, str):
+        os.remove(source)
+
+
+def iter_raw_data_rows(source, path):
+    """Stream the raw data sheet as tuples in read-only mode, dropping trailing empty rows"""
+    with open_download(source) as f:
+        wb = openpyxl.load_workbook(f, read_only=True)
+        try:
+            raw_data_sheet = find_raw_data_sheet(wb, path)
+            empty_rows = []
+            for row in raw_data_sheet.iter_rows(values_only=True):
+                if all(value is None for value in row):
+                    empty_rows.append(row)
+                    continue
+                yield from empty_rows
+                empty_rows = []
+                yield row
+        finally:
+            wb.close()
+
+
+def load_raw_data_array(source, path):
+    if not settings.ASSAY_WORKBOOK_READ_ONLY:
+        with open_download(source) as f:
+            wb = openpyxl.load_workbook(f)
+        raw_data_sheet = find_raw_data_sheet(wb, path)
+        return [[cell.value for cell in row] for row in raw_data_sheet]
+    file_data_array = [list(row) for row in iter_raw_data_rows(source, path)]
+    width = max((len(row) for row in file_data_array), default=0)
+    for row in file_data_array:
+        row.extend([None] * (width - len(row)))
+    return file_data_array
+
+
+def parse_raw_data_array(source, path):
+    """load_raw_data_array that also returns the parse time, runs in the parse worker processes"""
+    started = time.perf_counter()
+    file_data_array = load_raw_data_array(source, path)
+    return file_data_array, time.perf_counter() - started
+
+
+def record_parse(file_data_array, seconds):
+    metrics = get_metrics()
+    metrics.observe('assay_file_parse_seconds', seconds)
+    metrics.inc('assay_rows_parsed_total', len(file_data_array))
+    metrics.inc('assay_files_parsed_total')
+
+
 def get_metadata_by_key(l, key):
     for item in l:
         if key in item:
@@ -36,9 +112,29 @@ def get_custom_property_by_key(l, namespace, key):
 def get_run_group_name(mapping_template_id):
     return mapping_template_id
 
+
+class PooledEgnyteClient(egnyte.EgnyteClient):
+    """EgnyteClient that sends its requests through the shared HttpTransport"""
+
+    def __init__(self, config, transport, base_url=None):
+        super().__init__(config)
+        self.transport = transport
+        if base_url:
+            self._url_prefix = base_url.rstrip('/') + '/'
+        self._headers = {k: v for k, v in self._session.headers.items() if k == 'Authorization'}
+        self._session.close()
+        self._session = transport.session_for(self._url_prefix)
+
+    def _retry(self, func, url, **kwargs):
+        headers = dict(self._headers)
+        headers.update(kwargs.pop('headers', None) or {})
+        return self.transport.request(func.__name__.upper(), url, headers=headers, **kwargs)
+
+
 class EgnyteInterface:
 
-    def __init__(self, egnyte_domain, egnyte_access_token, project_id=None, cdd_interface=None, dry_run=False):
+    def __init__(self, egnyte_domain, egnyte_access_token, project_id=None, cdd_interface=None, dry_run=False,
+                 transport=None, checkpoint_store=None, content_cache=None):
         self.egnyte_domain = egnyte_domain
         self.egnyte_access_token = egnyte_access_token
         self.cdd_interface = cdd_interface
@@ -46,23 +142,38 @@ class EgnyteInterface:
         self.assay_runs_to_upload = {}
         self.dry_run = dry_run
         self.lock_file_name = "{}.lock".format(egnyte_domain)
-        self.egnyte_client = egnyte.EgnyteClient({'domain': egnyte_domain,
-                                                  'access_token': egnyte_access_token})
-
-    def _make_request(self, url, method, params=None, json=None, data=None, files=None, raw=False):
+        self.checkpoint_store = checkpoint_store or get_checkpoint_store()
+        self.content_cache = content_cache or get_content_cache()
+        self._queued_checksums = {}
+        self._failed_paths = set()
+        self.event_cursor_name = "egnyte_event_id:{}".format(egnyte_domain)
+        self._metadata_cache = {}
+        self._metadata_paths_by_group_id = {}
+        self._metadata_lock = threading.Lock()
+        self.metadata_writer = MetadataWriter(self.set_metadata, egnyte_domain, self.checkpoint_store)
+        self.transport = transport or get_transport()
+        self.base_url = settings.EGNYTE_BASE_URL.format(domain=egnyte_domain)
+        self.transport.set_rate_limit(urlsplit(self.base_url).netloc, *settings.EGNYTE_RATE_LIMIT)
+        self.egnyte_client = PooledEgnyteClient({'domain': egnyte_domain,
+                                                 'access_token': egnyte_access_token}, self.transport, self.base_url)
+
+    @timed('egnyte_request_seconds', lambda self, url, method, *args, **kwargs: {
+        'method': method, 'endpoint': endpoint_label(urlsplit(url).path)})
+    def _make_request(self, url, method, params=None, json=None, data=None, files=None, raw=False, stream=False):
         root_log.debug(url)
-        time.sleep(0.2)
         headers = {'Authorization': 'Bearer ' + self.egnyte_access_token}
         if method == GET:
-            resp = requests.get(url, headers=headers, params=params)
+            resp = self.transport.request(GET, url, headers=headers, params=params, stream=stream)
         elif method == POST:
-            resp = requests.post(url, headers=headers, params=params, files=files, data=data, json=json)
+            resp = self.transport.request(POST, url, headers=headers, params=params, files=files, data=data, json=json)
         elif method == PUT:
-            resp = requests.put(url, headers=headers, params=params, data=data, json=json)
+            resp = self.transport.request(PUT, url, headers=headers, params=params, data=data, json=json)
         else:
             raise Exception("Unknown method: {}".format(method))
 
-        if resp.status_code == 200:
+        if resp.status_code == 200 and stream:
+            return resp
+        elif resp.status_code == 200:
             return resp.json() if not raw else resp.content
         elif resp.status_code == 204:
             return True
@@ -73,22 +184,69 @@ class EgnyteInterface:
             raise Exception(resp.content)
 
     def set_metadata(self, data, group_id, namespace):
-        url = "https://{}/pubapi/v1/fs/ids/file/{}/properties/{}".format(self.egnyte_domain, group_id, namespace)
+        url = "{}/pubapi/v1/fs/ids/file/{}/properties/{}".format(self.base_url, group_id, namespace)
         resp = self._make_request(url, PUT, json=data)
+        self.invalidate_metadata(group_id)
         return resp
 
+    def queue_metadata(self, data, group_id, namespace, on_written=None):
+        """set_metadata through the write-behind queue, sent by flush_metadata"""
+        self.metadata_writer.set(group_id, namespace, data, on_written)
+
+    def replay_metadata(self):
+        if not self.dry_run:
+            self.metadata_writer.replay()
+
+    def flush_metadata(self):
+        self.metadata_writer.flush()
+
     def get_metadata(self, path):
-        url = "https://{}/pubapi/v1/fs{}".format(self.egnyte_domain, quote(path))
-        resp = self._make_request(url, GET, params={'list_custom_metadata': True})
-        return resp
+        with self._metadata_lock:
+            future = self._metadata_cache.get(path)
+            is_owner = future is None
+            if is_owner:
+                future = self._metadata_cache[path] = Future()
+        if is_owner:
+            # concurrent lookups of the same path (e.g. a shared parent folder) wait on the first request
+            url = "{}/pubapi/v1/fs{}".format(self.base_url, quote(path))
+            try:
+                resp = self._make_request(url, GET, params={'list_custom_metadata': True})
+            except Exception as e:
+                with self._metadata_lock:
+                    self._metadata_cache.pop(path, None)
+                future.set_exception(e)
+                raise
+            if resp and resp.get('group_id'):
+                with self._metadata_lock:
+                    self._metadata_paths_by_group_id.setdefault(resp['group_id'], set()).add(path)
+            future.set_result(resp)
+        return future.result()
+
+    def invalidate_metadata(self, group_id=None):
+        with self._metadata_lock:
+            if group_id is None:
+                self._metadata_cache = {}
+                self._metadata_paths_by_group_id = {}
+            else:
+                for path in self._metadata_paths_by_group_id.pop(group_id, ()):
+                    self._metadata_cache.pop(path, None)
+
+    def reset_run_state(self):
+        """Drop the metadata and queued uploads left over from a previous run"""
+        self.invalidate_metadata()
+        self.assay_runs_to_upload = {}
+        self._queued_checksums = {}
+        self._failed_paths = set()
+        if self.cdd_interface:
+            self.cdd_interface.reset_run_state()
 
     def get_file_info_by_id(self, group_id):
-        url = "https://{}/pubapi/v1/fs/ids/file/{}".format(self.egnyte_domain, group_id)
+        url = "{}/pubapi/v1/fs/ids/file/{}".format(self.base_url, group_id)
         resp = self._make_request(url, GET)
         return resp
 
     def search_by_metadata(self, key_value_pairs, content_type='FILE'):
-        url = "https://{}/pubapi/v1/search".format(self.egnyte_domain)
+        url = "{}/pubapi/v1/search".format(self.base_url)
         data = {
           "type": content_type,
           "key_with_value": key_value_pairs
@@ -97,7 +255,7 @@ class EgnyteInterface:
         return resp
 
     def get_file_by_path(self, path, entry_id=None):
-        url = "https://{}/pubapi/v1/fs-content/{}".format(self.egnyte_domain, path)
+        url = "{}/pubapi/v1/fs-content/{}".format(self.base_url, path)
         params = {}
         if entry_id:
             params['entry_id'] = entry_id
@@ -105,12 +263,24 @@ class EgnyteInterface:
         return resp
 
     def get_file(self, group_id, entry_id):
-        url = "https://{}/pubapi/v1/fs-content/ids/file/{}".format(self.egnyte_domain, group_id)
+        url = "{}/pubapi/v1/fs-content/ids/file/{}".format(self.base_url, group_id)
         resp = self._make_request(url, GET, params={'entry_id': entry_id}, raw=True)
         fresp = self.get_file_info_by_id(group_id)
         filename = fresp['name']
         return resp, filename
 
+    def get_file_stream(self, group_id, entry_id):
+        """Callable that starts a download and yields its content in chunks; calling it again restarts the download"""
+        url = "{}/pubapi/v1/fs-content/ids/file/{}".format(self.base_url, group_id)
+
+        def iter_content():
+            resp = self._make_request(url, GET, params={'entry_id': entry_id}, stream=True)
+            if resp is None:
+                raise Exception("File not found: group id {} entry id {}".format(group_id, entry_id))
+            with resp:
+                yield from resp.iter_content(settings.CDD_UPLOAD_CHUNK_SIZE)
+        return iter_content
+
     def get_files_by_integration_id(self, integration_id):
         files = []
         key_value_pairs = [
@@ -124,11 +294,13 @@ class EgnyteInterface:
         for result in resp['results']:
             if get_custom_property_by_key(result['file_custom_properties'], EGNYTE_CDD_SECTION_KEY, EGNYTE_FILE_CDD_STATUS)['value'] != EGNYTE_FILE_CDD_STATUS_PROCESSING:
                 continue
-            file_metadata = self.get_metadata("{}/{}".format(result['path'], result['name']))
             loaded_entry_id = get_custom_property_by_key(result['file_custom_properties'], EGNYTE_CDD_SECTION_KEY, EGNYTE_LOADED_ENTRY_ID)
             if loaded_entry_id:
-                file_obj, filename = self.get_file(file_metadata['group_id'], loaded_entry_id['value'])
-                files.append((file_obj, result['name'], file_metadata['group_id']))
+                group_id = result.get('group_id') or self.get_metadata("{}/{}".format(result['path'], result['name']))['group_id']
+                file_stream = self.get_file_stream(group_id, loaded_entry_id['value'])
+                # the search result describes the current version, its size only applies if that is the loaded one
+                size = result.get('size') if result.get('entry_id') == loaded_entry_id['value'] else None
+                files.append((file_stream, result['name'], group_id, size))
         return files
 
     def _check_for_new_events(self, egnyte_path):
@@ -142,54 +314,199 @@ class EgnyteInterface:
             event_id = events_queue.oldest_event_id
         else:
             event_id = last_event_id
-        while event_id != final_event_id:
-            root_log.info("current event id: {}".format(event_id))
-            try:
-                events = events_queue.list(event_id, count=100)  # get events in batches
-            except egnyte.exc.RequestError:
-                events = []
-            else:
-                for event in events:
-                    event_id = max(event_id, event.id)
-
-                    if event.action not in ['create', 'move', 'copy'] or event.data['is_folder'] is True:
-                        continue
-                    events_to_process.setdefault(event.data['target_path'], []).append(event)
-
-                root_log.info("returned: {} events, event id: {}, last: {}".format(len(events), event_id, final_event_id))
-            if not len(events):
-                event_id = final_event_id
+        reader = EventReader(events_queue, event_id, final_event_id)
+        for event in reader:
+            if event.action not in ['create', 'move', 'copy'] or event.data['is_folder'] is True:
+                continue
+            # only the newest event per target path decides what gets processed
+            events_to_process.pop(event.data['target_path'], None)
+            events_to_process[event.data['target_path']] = [event]
+        event_id = reader.event_id
+        stats = reader.get_stats()
+        root_log.info("Read {events} events in {pages} pages ({retries} retries), backlog {backlog}, "
+                      "{events_per_second:.1f} events/s, {targets} target paths".format(targets=len(events_to_process), **stats))
 
         return events_to_process, event_id
 
     def _get_last_event_id(self, latest_event_id):
-        try:
-            f = open(self.lock_file_name, 'r')
-        except FileNotFoundError:
-            event_id = latest_event_id
-        else:
-            l = f.readlines()
-            event_id = int(l[-1].strip())
-        return event_id
+        # fall back to the legacy append-only lock file the first time the checkpoint store is used
+        event_id = self.checkpoint_store.get_cursor(self.event_cursor_name) or read_last_line(self.lock_file_name)
+        return int(event_id) if event_id else latest_event_id
 
     def process_new_assay_files(self, base_path):
+        with get_cursor_lock(self.event_cursor_name):
+            self.replay_metadata()
+            try:
+                self._process_new_assay_files(base_path)
+            finally:
+                self.flush_metadata()
+
+    def _process_new_assay_files(self, base_path):
+        self.reset_run_state()
         events_by_target_path, max_event_id = self._check_for_new_events(base_path)
+        waiting_paths = self._resolve_pending_slurps()
+        # paths whose upload failed before are behind the cursor, retry them first
+        retry_paths = [_ for _ in self.checkpoint_store.get_failed(self.egnyte_domain) if _ not in events_by_target_path]
+        target_paths = list(retry_paths)
         for target_path, events in events_by_target_path.items():
-            file_metadata = self.get_metadata(target_path)
-            if not file_metadata:
+            entry_id = events[-1].data.get('target_id')
+            if entry_id and self.checkpoint_store.is_processed(self.egnyte_domain, target_path, entry_id):
                 continue
-            folder_cdd_data = self._get_folder_cdd_data(target_path)
-            print(folder_cdd_data)
-            if folder_cdd_data and folder_cdd_data.get(EGNYTE_MAPPING_TEMPLATE_ID):
-                self._process_file(file_metadata, folder_cdd_data)
+            target_paths.append(target_path)
+        root_log.info("{} target paths, {} already processed, {} failed before".format(
+            len(events_by_target_path), len(events_by_target_path) + len(retry_paths) - len(target_paths), len(retry_paths)))
+        target_paths = self._defer_waiting_paths(target_paths, waiting_paths)
+        self._process_target_paths(target_paths)
         if self.assay_runs_to_upload:
             self._upload_assay_runs()
-        self._update_lock_file(max_event_id)
-
-    def _update_lock_file(self, last_event_id):
+        self._update_failed_paths(target_paths)
+        self._update_event_cursor(max_event_id)
+
+    def process_target_paths(self, entry_ids_by_target_path):
+        """Process paths pushed by the webhook receiver, the event cursor is left for the poller to reconcile"""
+        with get_cursor_lock(self.event_cursor_name):
+            self.reset_run_state()
+            self.replay_metadata()
+            target_paths = [target_path for target_path, entry_id in entry_ids_by_target_path.items()
+                            if not (entry_id and self.checkpoint_store.is_processed(self.egnyte_domain, target_path, entry_id))]
+            root_log.info("{} pushed target paths, {} already processed".format(
+                len(entry_ids_by_target_path), len(entry_ids_by_target_path) - len(target_paths)))
+            try:
+                target_paths = self._defer_waiting_paths(target_paths, self._resolve_pending_slurps())
+                self._process_target_paths(target_paths)
+                if self.assay_runs_to_upload:
+                    self._upload_assay_runs()
+                self._update_failed_paths(target_paths)
+            finally:
+                self.flush_metadata()
+
+    def _mark_processed(self, target_path, entry_id):
+        if not self.dry_run:
+            self.checkpoint_store.mark_processed(self.egnyte_domain, target_path, entry_id)
+
+    def _process_target_paths(self, target_paths):
+        if settings.EGNYTE_DOWNLOAD_WORKERS <= 1:
+            for target_path in target_paths:
+                file_info = self._get_target_file_info(target_path)
+                if file_info:
+                    self._process_file(*file_info)
+        else:
+            self._process_target_paths_concurrently(target_paths)
+
+    def _process_target_paths_concurrently(self, target_paths):
+        parse_processes = settings.ASSAY_PARSE_PROCESSES or os.cpu_count()
+        with ContextThreadPoolExecutor(max_workers=settings.EGNYTE_DOWNLOAD_WORKERS) as download_pool, \
+                ProcessPoolExecutor(max_workers=parse_processes, mp_context=multiprocessing.get_context('spawn')) as parse_pool:
+            parse_futures = {}
+            download_futures = {download_pool.submit(self._download_target_path, target_path): idx
+                                for idx, target_path in enumerate(target_paths)}
+            for download_future in as_completed(download_futures):
+                downloaded = download_future.result()
+                if downloaded:
+                    file_metadata, folder_cdd_data, source, file_data_array = downloaded
+                    parse_future = None
+                    if file_data_array is None:
+                        parse_future = parse_pool.submit(parse_raw_data_array, source, file_metadata['path'])
+                    parse_futures[download_futures[download_future]] = (file_metadata, folder_cdd_data, source,
+                                                                         file_data_array, parse_future)
+            # merge in event order so the result matches the serial path
+            for idx in sorted(parse_futures):
+                file_metadata, folder_cdd_data, source, file_data_array, parse_future = parse_futures[idx]
+                if parse_future:
+                    try:
+                        file_data_array, parse_seconds = parse_future.result()
+                    finally:
+                        release_download(source)
+                    file_data_array = self._record_parse(file_metadata, file_data_array, parse_seconds)
+                self._add_assay_run_file(file_data_array, file_metadata, folder_cdd_data)
+
+    def _get_target_file_info(self, target_path):
+        file_metadata = self.get_metadata(target_path)
+        if not file_metadata:
+            return None
+        folder_cdd_data = self._get_folder_cdd_data(target_path)
+        print(folder_cdd_data)
+        if folder_cdd_data and folder_cdd_data.get(EGNYTE_MAPPING_TEMPLATE_ID):
+            return file_metadata, folder_cdd_data
+        self._mark_processed(target_path, file_metadata['entry_id'])
+
+    def _download_target_path(self, target_path):
+        file_info = self._get_target_file_info(target_path)
+        if file_info and self._needs_processing(*file_info):
+            file_metadata, folder_cdd_data = file_info
+            file_data_array = self.content_cache.get_parsed(file_metadata.get('checksum'))
+            if file_data_array is not None:
+                return file_metadata, folder_cdd_data, None, file_data_array
+            return file_metadata, folder_cdd_data, self._download_file(file_metadata), None
+
+    def _record_pending_slurp(self, assay_run_list, integration_uuid, error, mapping_template_id):
+        """Keep a group whose slurp was submitted but not confirmed, it is finished by a later run rather than uploaded again"""
+        root_log.warning("{}, integration id {} is checked again on the next run".format(error, integration_uuid))
+        files = []
+        for assay_run in assay_run_list:
+            duplicates = self._queued_checksums.get((mapping_template_id, assay_run.checksum), ()) if assay_run.checksum else ()
+            files.append({'name': assay_run.source_file_name, 'path': assay_run.source_path, 'entry_id': assay_run.entry_id,
+                          'group_id': assay_run.group_id, 'checksum': assay_run.checksum, 'valid': assay_run.valid is True,
+                          'duplicates': [{'path': _['path'], 'entry_id': _['entry_id'], 'group_id': _['group_id']}
+                                         for _ in duplicates]})
+        self.checkpoint_store.add_pending_slurp(self.egnyte_domain, error.slurp_id, {
+            'slurp_id': error.slurp_id, 'integration_id': integration_uuid, 'mapping_template_id': mapping_template_id,
+            'files': files})
+
+    def _resolve_pending_slurps(self):
+        """Finish the groups of pending slurps that ended, returns the target paths still waiting on one"""
+        waiting_paths = set()
+        for pending in self.checkpoint_store.get_pending_slurps(self.egnyte_domain):
+            slurp_id, mapping_template_id = pending['slurp_id'], pending['mapping_template_id']
+            try:
+                state = self.cdd_interface.get_slurp_state(slurp_id)
+            except Exception as e:
+                root_log.error("Checking pending slurp {} failed: {}".format(slurp_id, e))
+                state = None
+            if state not in CDD_SLURP_IN_PROGRESS_STATUS:
+                for file_data in pending['files']:
+                    waiting_paths.add(file_data['path'])
+                    waiting_paths.update(_['path'] for _ in file_data['duplicates'])
+                continue
+            assay_run_list = []
+            for file_data in pending['files']:
+                assay_run = AssayRunFile(None, file_data['name'], file_data['entry_id'], file_data['group_id'],
+                                         source_path=file_data['path'], checksum=file_data['checksum'])
+                assay_run.valid = file_data['valid']
+                assay_run_list.append(assay_run)
+                if file_data['checksum']:
+                    self._queued_checksums[(mapping_template_id, file_data['checksum'])] = file_data['duplicates']
+            # a slurp that did not commit left nothing in CDD, its files are retried
+            result = slurp_id if state == CDD_SLURP_COMMITTED else Exception("Slurp {} ended {}".format(slurp_id, state))
+            self._set_assay_run_status(assay_run_list, pending['integration_id'], result, mapping_template_id)
+            for file_data in pending['files']:
+                self._queued_checksums.pop((mapping_template_id, file_data['checksum']), None)
+            self.checkpoint_store.clear_pending_slurp(self.egnyte_domain, slurp_id)
+        return waiting_paths
+
+    def _defer_waiting_paths(self, target_paths, waiting_paths):
+        """Leave out the paths of slurps that are still pending, they are retried once it ended"""
+        deferred = [_ for _ in target_paths if _ in waiting_paths]
+        if deferred:
+            root_log.info("{} target paths wait on a pending slurp".format(len(deferred)))
+            self._failed_paths.update(deferred)
+        return [_ for _ in target_paths if _ not in waiting_paths]
+
+    def _update_failed_paths(self, target_paths):
+        """Persist the paths whose upload failed in this run and forget the processed ones that failed before"""
+        if self.dry_run:
+            return
+        self.checkpoint_store.clear_failed(self.egnyte_domain, [_ for _ in target_paths if _ not in self._failed_paths])
+        for target_path in self._failed_paths:
+            self.checkpoint_store.mark_failed(self.egnyte_domain, target_path)
+        if self._failed_paths:
+            root_log.warning("{} target paths failed to upload or wait on a slurp, they are retried on the next run".format(
+                len(self._failed_paths)))
+
+    def _update_event_cursor(self, last_event_id):
         if not self.dry_run:
-            with open(self.lock_file_name, 'a+') as f:
-                f.write("\n{}".format(last_event_id))
+            self.checkpoint_store.set_cursor(self.event_cursor_name, last_event_id)
+            self.checkpoint_store.compact()
 
     def _get_folder_cdd_data(self, path, depth=0):
         parents = pathlib.Path(path).parents
@@ -203,24 +520,81 @@ class EgnyteInterface:
             #     cdd_data = self._get_folder_cdd_data(parents[0], depth + 1)
         return cdd_data
 
-    def _process_file(self, file_metadata, folder_cdd_data):
+    def _needs_processing(self, file_metadata, folder_cdd_data):
         file_cdd_data = get_metadata_by_key(file_metadata['custom_metadata'], EGNYTE_CDD_SECTION_KEY)
         loaded_entry_id = file_cdd_data.get(EGNYTE_LOADED_ENTRY_ID) if file_cdd_data else None
+        #TODO Need to delete run/reject slurp if updated file.
         if not loaded_entry_id or loaded_entry_id != file_metadata['entry_id']:
-            #TODO Need to delete run/reject slurp if updated file.
-            file_cdd_data = get_metadata_by_key(file_metadata['custom_metadata'], EGNYTE_CDD_SECTION_KEY)
-            file_obj = self.egnyte_client.file(file_metadata['path'])
-            with file_obj.download() as download:
-                wb = openpyxl.load_workbook((BytesIO(download.read())))
-            file_data_array = []
-            raw_data_sheet = find_raw_data_sheet(wb, file_metadata['path'])
-            for row in raw_data_sheet:
-                file_data_array.append([cell.value for cell in row])
-            self.assay_runs_to_upload.setdefault(folder_cdd_data[EGNYTE_MAPPING_TEMPLATE_ID], []).append(AssayRunFile(
-                file_data_array, file_metadata['name'], file_metadata['entry_id'], file_metadata['group_id']))
+            upload = self.content_cache.get_upload(file_metadata.get('checksum'), self.project_id,
+                                                   folder_cdd_data[EGNYTE_MAPPING_TEMPLATE_ID])
+            if not upload:
+                return True
+            if upload['source_path'] == file_metadata['path']:
+                # saved again unchanged, the file keeps the status of its upload
+                root_log.info("{} is unchanged since slurp {}".format(file_metadata['path'], upload['slurp_id']))
+                if not self.dry_run:
+                    self.queue_metadata({'loaded entry id': file_metadata['entry_id']}, file_metadata['group_id'],
+                                        EGNYTE_CDD_SECTION_KEY,
+                                        lambda: self._mark_processed(file_metadata['path'], file_metadata['entry_id']))
+                return False
+            root_log.info("{} has the same content as {}, already uploaded in slurp {}".format(
+                file_metadata['path'], upload['source_path'], upload['slurp_id']))
+            self._mark_duplicate(file_metadata['entry_id'], file_metadata['group_id'], file_metadata['path'],
+                                 upload['slurp_id'], upload['integration_id'])
+            return False
+        self._mark_processed(file_metadata['path'], file_metadata['entry_id'])
+        return False
+
+    def _mark_duplicate(self, entry_id, group_id, path, slurp_id, integration_id):
+        if self.dry_run:
+            return
+        metadata = {'status': EGNYTE_FILE_CDD_STATUS_DUPLICATE, 'slurp id': str(slurp_id),
+                    'integration id': integration_id, 'loaded entry id': entry_id}
+        self.queue_metadata(metadata, group_id, EGNYTE_CDD_SECTION_KEY, lambda: self._mark_processed(path, entry_id))
+
+    @timed('egnyte_download_seconds')
+    def _download_file(self, file_metadata):
+        file_obj = self.egnyte_client.file(file_metadata['path'])
+        with file_obj.download() as download:
+            if (file_metadata.get('size') or 0) <= settings.ASSAY_SPOOL_THRESHOLD:
+                return download.read()
+            with tempfile.NamedTemporaryFile(suffix=pathlib.Path(file_metadata['path']).suffix, delete=False) as f:
+                download.write_to(f)
+            return f.name
+
+    @timed('assay_file_process_seconds')
+    def _process_file(self, file_metadata, folder_cdd_data):
+        if self._needs_processing(file_metadata, folder_cdd_data):
+            file_data_array = self.content_cache.get_parsed(file_metadata.get('checksum'))
+            if file_data_array is None:
+                source = self._download_file(file_metadata)
+                try:
+                    file_data_array, parse_seconds = parse_raw_data_array(source, file_metadata['path'])
+                finally:
+                    release_download(source)
+                file_data_array = self._record_parse(file_metadata, file_data_array, parse_seconds)
+            self._add_assay_run_file(file_data_array, file_metadata, folder_cdd_data)
+
+    def _record_parse(self, file_metadata, file_data_array, parse_seconds):
+        record_parse(file_data_array, parse_seconds)
+        return self.content_cache.set_parsed(file_metadata.get('checksum'), file_data_array)
+
+    def _add_assay_run_file(self, file_data_array, file_metadata, folder_cdd_data):
+        mapping_template_id = folder_cdd_data[EGNYTE_MAPPING_TEMPLATE_ID]
+        checksum = file_metadata.get('checksum')
+        if checksum and (mapping_template_id, checksum) in self._queued_checksums:
+            # a copy of a file already queued in this run, marked once the original is uploaded
+            self._queued_checksums[(mapping_template_id, checksum)].append(file_metadata)
+            return
+        if checksum:
+            self._queued_checksums[(mapping_template_id, checksum)] = []
+        self.assay_runs_to_upload.setdefault(mapping_template_id, []).append(AssayRunFile(
+            file_data_array, file_metadata['name'], file_metadata['entry_id'], file_metadata['group_id'],
+            source_path=file_metadata['path'], checksum=checksum))
 
     def _upload_assay_runs(self):
         logging.info(self.assay_runs_to_upload.keys())
+        uploads = []
         for mapping_template_id, assay_run_file_list in self.assay_runs_to_upload.items():
             assay_runs = self.cdd_interface.validate_and_group_file_arrays(assay_run_file_list, mapping_template_id).items()
             for assay_run_group_key, assay_run_list in assay_runs:
@@ -232,18 +606,65 @@ class EgnyteInterface:
                     continue
                 else:
                     assay_run_group_key = "{} - {}".format(datetime.date.today().isoformat(), assay_run_group_key)
-                    slurp_id = self.cdd_interface.upload_assay_run(assay_run_list, self.project_id,
-                                                                   mapping_template_id, integration_uuid, assay_run_group_key + '.csv')
-                    logging.info("Slurp: {}".format(slurp_id))
-                    for assay_run in assay_run_list:
-                        metadata = {'status': EGNYTE_FILE_CDD_STATUS_PROCESSING if assay_run.valid is True else EGNYTE_FILE_CDD_STATUS_FAILED,
-                            'slurp id': str(slurp_id) if slurp_id else 0,
-                            'loaded entry id': assay_run.entry_id,
-                            'integration id': integration_uuid
-                        }
-
-                        resp = self.set_metadata(metadata, assay_run.group_id, EGNYTE_CDD_SECTION_KEY)
-                        if resp:
-                            logging.info("Processed entry id: {}".format(assay_run.entry_id))
+                    uploads.append((assay_run_list, self.project_id, mapping_template_id, integration_uuid,
+                                    assay_run_group_key + '.csv'))
+        if settings.CDD_UPLOAD_CONCURRENCY <= 1:
+            for upload in uploads:
+                # a failed group is marked like on the concurrent path instead of aborting the others
+                try:
+                    slurp_id = self.cdd_interface.upload_assay_run(*upload)
+                except Exception as e:
+                    slurp_id = e
+                self._set_assay_run_status(upload[0], upload[3], slurp_id, upload[2])
+        elif uploads:
+            for upload, slurp_id in zip(uploads, self.cdd_interface.upload_assay_runs(uploads)):
+                self._set_assay_run_status(upload[0], upload[3], slurp_id, upload[2])
+
+    def _set_assay_run_status(self, assay_run_list, integration_uuid, slurp_id, mapping_template_id=None):
+        if isinstance(slurp_id, SlurpWaitError):
+            return self._record_pending_slurp(assay_run_list, integration_uuid, slurp_id, mapping_template_id)
+        upload_failed = isinstance(slurp_id, Exception)
+        if upload_failed:
+            root_log.error("Upload failed for integration id {}: {}".format(integration_uuid, slurp_id))
+        else:
+            logging.info("Slurp: {}".format(slurp_id))
 
+        def set_status(assay_run):
+            metadata = {'status': EGNYTE_FILE_CDD_STATUS_PROCESSING if assay_run.valid is True and not upload_failed else EGNYTE_FILE_CDD_STATUS_FAILED,
+                'slurp id': str(slurp_id) if slurp_id and not upload_failed else 0,
+                'integration id': integration_uuid
+            }
+            if not upload_failed:
+                # leave the loaded entry id unset on failed uploads so the file is picked up again
+                metadata['loaded entry id'] = assay_run.entry_id
+            def on_written():
+                logging.info("Processed entry id: {}".format(assay_run.entry_id))
+                if not upload_failed and assay_run.source_path:
+                    self._mark_processed(assay_run.source_path, assay_run.entry_id)
+            self.queue_metadata(metadata, assay_run.group_id, EGNYTE_CDD_SECTION_KEY, on_written)
+            if upload_failed and assay_run.source_path:
+                self._failed_paths.add(assay_run.source_path)
+            if not assay_run.checksum:
+                return
+            duplicates = self._queued_checksums.get((mapping_template_id, assay_run.checksum), ())
+            if upload_failed:
+                # copies queued behind a failed original fail with it and are retried with it
+                for duplicate in duplicates:
+                    self.queue_metadata(dict(metadata), duplicate['group_id'], EGNYTE_CDD_SECTION_KEY)
+                    self._failed_paths.add(duplicate['path'])
+                return
+            if assay_run.valid is True:
+                self.content_cache.set_upload(assay_run.checksum, self.project_id, mapping_template_id,
+                                              slurp_id, integration_uuid, assay_run.source_path)
+            for duplicate in duplicates:
+                if assay_run.valid is True:
+                    self._mark_duplicate(duplicate['entry_id'], duplicate['group_id'], duplicate['path'],
+                                         slurp_id, integration_uuid)
+                else:
+                    # same bytes, same validation failure
+                    self.queue_metadata(dict(metadata, **{'loaded entry id': duplicate['entry_id']}),
+                                        duplicate['group_id'], EGNYTE_CDD_SECTION_KEY,
+                                        lambda duplicate=duplicate: self._mark_processed(duplicate['path'], duplicate['entry_id']))
 
+        for assay_run in assay_run_list:
+            set_status(assay_run)
@@ -0,0 +1,77 @@
+import egnyte
+import logging
+import settings
+import time
+
+from local_lib.common import ContextThreadPoolExecutor
+
+root_log = logging.getLogger()
+
+
+class EventReader:
+    """
+    Pages through a filtered Egnyte events queue from start_id up to final_id.
+    The next page is requested in the background as soon as the current one arrives, so it is fetched while
+    the current page is being filtered. Failed pages are retried with backoff instead of ending the read.
+    """
+
+    def __init__(self, events_queue, start_id, final_id, page_size=None, max_retries=None, backoff_factor=None):
+        self.events_queue = events_queue
+        self.start_id = start_id
+        self.final_id = final_id
+        self.page_size = page_size or settings.EGNYTE_EVENT_PAGE_SIZE
+        self.max_retries = settings.EGNYTE_EVENT_PAGE_RETRIES if max_retries is None else max_retries
+        self.backoff_factor = settings.HTTP_BACKOFF_FACTOR if backoff_factor is None else backoff_factor
+        self.event_id = start_id
+        self.pages = 0
+        self.events = 0
+        self.retries = 0
+        self.elapsed = 0
+
+    def _fetch(self, start_id):
+        attempt = 0
+        while True:
+            try:
+                return list(self.events_queue.list(start_id, count=self.page_size))
+            except egnyte.exc.RequestError as e:
+                if attempt >= self.max_retries:
+                    raise Exception("Failed to read Egnyte events after id {}: {!r}".format(start_id, e))
+                attempt += 1
+                self.retries += 1
+                delay = min(settings.HTTP_MAX_BACKOFF, self.backoff_factor * (2 ** attempt))
+                root_log.warning("Egnyte events page after id {} failed ({!r}), retry {} in {:.1f}s".format(
+                    start_id, e, attempt, delay))
+                time.sleep(delay)
+
+    def pages_iter(self):
+        """Yield each page of events, with the request for the following page already in flight"""
+        started = time.monotonic()
+        with ContextThreadPoolExecutor(max_workers=1) as executor:
+            pending = executor.submit(self._fetch, self.event_id) if self.event_id != self.final_id else None
+            while pending is not None:
+                events = pending.result()
+                pending = None
+                self.pages += 1
+                self.events += len(events)
+                if events:
+                    self.event_id = max(self.event_id, max(_.id for _ in events))
+                else:
+                    self.event_id = self.final_id
+                if self.event_id != self.final_id:
+                    pending = executor.submit(self._fetch, self.event_id)
+                root_log.info("returned: {} events, event id: {}, last: {}".format(len(events), self.event_id, self.final_id))
+                yield events
+        self.elapsed = time.monotonic() - started
+
+    def __iter__(self):
+        for events in self.pages_iter():
+            yield from events
+
+    def get_stats(self):
+        return {
+            'pages': self.pages,
+            'events': self.events,
+            'retries': self.retries,
+            'backlog': max(0, self.final_id - self.start_id),
+            'events_per_second': self.events / self.elapsed if self.elapsed else 0,
+        }
@@ -0,0 +1,95 @@
+import json
+import re
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+NUMBER_START = '-0123456789'
+NUMBER_END = re.compile(r'[,\]} \t\n\r]')
+
+_decoder = json.JSONDecoder()
+
+
+class _Buffer:
+    """Text read from f chunk by chunk, only the part not yet decoded is kept"""
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        data = self.f.read(self.chunk_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next non whitespace character, None at the end of the input"""
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return None
+
+    def expect(self, chars):
+        char = self.peek()
+        if char is None or char not in chars:
+            raise ValueError("Expected one of {!r} but found {!r} in JSON stream".format(chars, char))
+        self.pos += 1
+        return char
+
+    def value(self):
+        char = self.peek()
+        if char is not None and char in NUMBER_START:
+            # a number is only complete once whatever follows it has been read
+            while not NUMBER_END.search(self.buf, self.pos) and self._fill():
+                pass
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            self.pos = end
+            return value
+
+
+def _iter_array(buf):
+    buf.expect('[')
+    if buf.peek() == ']':
+        buf.pos += 1
+        return
+    while True:
+        yield buf.value()
+        if buf.expect(',]') == ']':
+            return
+
+
+def iter_json_array(f, key=None, chunk_size=64 * 1024):
+    """
+    Yield the items of a JSON array read from the text file f one at a time, so memory is bounded by the largest item
+    rather than the document. The array is the top level value, or the value of key in the top level object; the
+    object's other values are decoded and dropped.
+    """
+    buf = _Buffer(f, chunk_size)
+    if key is None or buf.peek() != '{':
+        yield from _iter_array(buf)
+        return
+    buf.expect('{')
+    if buf.peek() == '}':
+        return
+    while True:
+        name = buf.value()
+        buf.expect(':')
+        if name == key:
+            yield from _iter_array(buf)
+        else:
+            buf.value()
+        if buf.expect(',}') == '}':
+            return
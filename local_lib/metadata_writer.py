@@ -0,0 +1,117 @@
+import logging
+import settings
+import threading
+import traceback
+import uuid
+
+from local_lib.checkpoint import get_checkpoint_store
+from local_lib.common import ContextThreadPoolExecutor
+from local_lib.metrics import get_metrics
+
+root_log = logging.getLogger()
+
+# journaled writes owned by another process were left behind by a crash and can be replayed
+PROCESS_OWNER = uuid.uuid4().hex
+
+
+class MetadataWriter:
+    """
+    Write-behind queue for Egnyte custom metadata.
+    Writes to the same group_id/namespace are merged until the next flush, which sends them concurrently,
+    batch_size at a time, through write(data, group_id, namespace). Every write is journaled in the checkpoint store
+    before it is queued and cleared once sent, so writes lost to a crash or a failed flush are replayed by replay().
+    A flush triggered by a full queue only logs its failures, they are raised by the next flush(raise_errors=True).
+    """
+
+    def __init__(self, write, scope, checkpoint_store=None, workers=None, batch_size=None):
+        self.write = write
+        self.scope = scope
+        self.checkpoint_store = checkpoint_store or get_checkpoint_store()
+        self.workers = workers or settings.EGNYTE_METADATA_WORKERS
+        self.batch_size = batch_size or settings.EGNYTE_METADATA_BATCH_SIZE
+        self.pending = {}
+        self.stats = {'queued': 0, 'coalesced': 0, 'replayed': 0, 'written': 0, 'failed': 0}
+        self._unreported = [0, 0]  # failed and attempted writes of the flushes that did not raise
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def _queue(self, group_id, namespace, data, queued_at, on_written=None):
+        key = (group_id, namespace)
+        if key in self.pending:
+            self.stats['coalesced'] += 1
+            get_metrics().inc('egnyte_metadata_coalesced_total')
+        entry = self.pending.setdefault(key, {'data': {}, 'callbacks': [], 'queued_at': queued_at})
+        entry['data'].update(data)
+        entry['queued_at'] = max(entry['queued_at'], queued_at)
+        if on_written:
+            entry['callbacks'].append(on_written)
+
+    def set(self, group_id, namespace, data, on_written=None):
+        """Queue a write, on_written() is called once it has been sent"""
+        with self._lock:
+            queued_at = self.checkpoint_store.journal_metadata(self.scope, group_id, namespace, data, PROCESS_OWNER)
+            self._queue(group_id, namespace, data, queued_at, on_written)
+            self.stats['queued'] += 1
+            full = len(self.pending) >= self.batch_size
+        if full:
+            # may run in a download worker, a failed write must not abort the sync from here
+            self.flush(raise_errors=False)
+
+    def replay(self):
+        """Queue the journaled writes that were never confirmed"""
+        with self._lock:
+            rows = self.checkpoint_store.claim_metadata(self.scope, PROCESS_OWNER)
+            for group_id, namespace, data, queued_at in rows:
+                self._queue(group_id, namespace, data, queued_at)
+            self.stats['replayed'] += len(rows)
+        if rows:
+            root_log.warning("Replaying {} unconfirmed Egnyte metadata writes".format(len(rows)))
+        return len(rows)
+
+    def _send(self, key, entry):
+        group_id, namespace = key
+        try:
+            self.write(entry['data'], group_id, namespace)
+        except Exception:
+            root_log.error("Metadata write for {} failed: {}".format(group_id, traceback.format_exc()))
+            self.checkpoint_store.release_metadata(self.scope, group_id, namespace)
+            get_metrics().inc('egnyte_metadata_writes_total', status='error')
+            return False
+        self.checkpoint_store.clear_metadata(self.scope, group_id, namespace, entry['queued_at'])
+        get_metrics().inc('egnyte_metadata_writes_total', status='ok')
+        for callback in entry['callbacks']:
+            callback()
+        return True
+
+    def flush(self, raise_errors=True):
+        """
+        Send everything queued. With raise_errors, raises once all were attempted if any write failed since the
+        last flush that raised, otherwise the failures are only logged.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self.pending = self.pending, {}
+            items = list(batch.items())
+            failed = 0
+            if items:
+                with ContextThreadPoolExecutor(max_workers=self.workers) as pool:
+                    for i in range(0, len(items), self.batch_size):
+                        chunk = items[i:i + self.batch_size]
+                        failed += list(pool.map(lambda _: self._send(*_), chunk)).count(False)
+                root_log.info("Flushed {} Egnyte metadata writes, {} failed".format(len(items), failed))
+            with self._lock:
+                self.stats['written'] += len(items) - failed
+                self.stats['failed'] += failed
+                self._unreported[0] += failed
+                self._unreported[1] += len(items)
+                if not raise_errors:
+                    return
+                failed, attempted = self._unreported
+                self._unreported = [0, 0]
+            if failed:
+                raise Exception("{} of {} Egnyte metadata writes failed, they are replayed on the next run".format(
+                    failed, attempted))
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, pending=len(self.pending))
@@ -0,0 +1,165 @@
+import functools
+import json
+import logging
+import os
+import re
+import settings
+import threading
+import time
+
+from local_lib.common import process_wide
+
+root_log = logging.getLogger()
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900, 1800, 3600)
+ID_SEGMENT = re.compile(r'^(\d+|[0-9a-fA-F-]{16,})$')
+# Egnyte file system endpoints carry the file path after this prefix
+PATH_ENDPOINTS = ['fs', 'fs-content']
+
+
+@process_wide
+def get_metrics():
+    return MetricsRegistry()
+
+
+def endpoint_label(path):
+    """Collapse ids and file paths out of a request path so it can be used as a low cardinality label"""
+    segments = [_ for _ in path.split('?')[0].split('/') if _]
+    if segments[:2] == ['pubapi', 'v1']:
+        segments = segments[2:]
+    label = []
+    for segment in segments:
+        label.append(':id' if ID_SEGMENT.match(segment) else segment)
+        if len(label) == 1 and segment in PATH_ENDPOINTS and segments[1:2] != ['ids']:
+            break
+    return '/'.join(label) or '/'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels) + "}"
+
+
+class Histogram:
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative_counts(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+    def quantile(self, q):
+        """Upper bucket bound holding the q-th observation"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        for bound, total in zip(self.buckets, self.cumulative_counts()):
+            if total >= rank:
+                return bound
+        return self.max
+
+
+class MetricsRegistry:
+    """Counters and histograms keyed by name and labels, exported as Prometheus text or a JSON summary"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def to_prometheus(self):
+        lines = []
+        with self._lock:
+            for name in sorted(set(_[0] for _ in self.counters)):
+                lines.append("# TYPE {} counter".format(name))
+                for (_, labels), value in sorted(_ for _ in self.counters.items() if _[0][0] == name):
+                    lines.append("{}{} {}".format(name, _format_labels(labels), value))
+            for name in sorted(set(_[0] for _ in self.histograms)):
+                lines.append("# TYPE {} histogram".format(name))
+                for (_, labels), histogram in sorted((_ for _ in self.histograms.items() if _[0][0] == name),
+                                                     key=lambda _: _[0]):
+                    for bound, total in zip(histogram.buckets, histogram.cumulative_counts()):
+                        lines.append("{}_bucket{} {}".format(name, _format_labels(labels + (('le', bound),)), total))
+                    lines.append("{}_bucket{} {}".format(name, _format_labels(labels + (('le', '+Inf'),)), histogram.count))
+                    lines.append("{}_sum{} {}".format(name, _format_labels(labels), histogram.sum))
+                    lines.append("{}_count{} {}".format(name, _format_labels(labels), histogram.count))
+        return "\n".join(lines) + "\n"
+
+    def get_summary(self):
+        summary = {'started': self.started, 'duration': time.time() - self.started, 'counters': {}, 'histograms': {}}
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                summary['counters'].setdefault(name, []).append({'labels': dict(labels), 'value': value})
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda _: _[0]):
+                summary['histograms'].setdefault(name, []).append({
+                    'labels': dict(labels), 'count': histogram.count, 'sum': round(histogram.sum, 6),
+                    'mean': round(histogram.sum / histogram.count, 6) if histogram.count else None,
+                    'p50': histogram.quantile(0.5), 'p95': histogram.quantile(0.95), 'max': round(histogram.max, 6)})
+        rows = sum(_['value'] for _ in summary['counters'].get('assay_rows_parsed_total', []))
+        parse_seconds = sum(_['sum'] for _ in summary['histograms'].get('assay_file_parse_seconds', []))
+        summary['rows_per_second'] = round(rows / parse_seconds, 1) if parse_seconds else None
+        return summary
+
+    def write_prometheus(self, path=None):
+        """Write the textfile collector format, replacing the file atomically"""
+        path = path or settings.METRICS_PROMETHEUS_PATH
+        if path:
+            with open(path + '.tmp', 'w') as f:
+                f.write(self.to_prometheus())
+            os.replace(path + '.tmp', path)
+
+    def write_summary(self, path=None):
+        """path may contain {timestamp} to keep one summary per run"""
+        path = path or settings.METRICS_SUMMARY_PATH
+        if path:
+            path = path.format(timestamp=time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started)))
+            with open(path, 'w') as f:
+                json.dump(self.get_summary(), f, indent=2, default=str)
+
+
+def timed(name, labels=None):
+    """Decorator observing the call duration in histogram name, labels(*args, **kwargs) returns extra labels"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            metric_labels = labels(*args, **kwargs) if labels else {}
+            started = time.perf_counter()
+            status = 'error'
+            try:
+                result = func(*args, **kwargs)
+                status = 'ok'
+                return result
+            finally:
+                get_metrics().observe(name, time.perf_counter() - started, status=status, **metric_labels)
+        return wrapper
+    return decorator
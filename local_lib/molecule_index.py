@@ -0,0 +1,108 @@
+import logging
+import settings
+import sqlite3
+import threading
+
+from datetime import datetime, timedelta
+from local_lib.common import process_wide
+
+root_log = logging.getLogger()
+
+SQLITE_MAX_PARAMS = 900
+UPDATE_CHUNK_SIZE = 5000
+
+
+@process_wide
+def get_molecule_index():
+    return MoleculeIndex()
+
+
+class MoleculeIndex:
+    """
+    Persisted batch -> molecule -> research project index, refreshed incrementally from a per vault watermark.
+    Each batch is recorded under the value of its own project field, so a re-tagged batch moves with it.
+    """
+
+    def __init__(self, path=None, window_days=None):
+        self.path = path or settings.CDD_MOLECULE_INDEX_PATH
+        self.window_days = window_days or settings.CDD_MOLECULE_INDEX_WINDOW_DAYS
+        self._lock = threading.Lock()
+        # held for a whole sync so parallel projects do not fetch the same batches twice
+        self.sync_lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS molecule_batches (
+                                vault_id TEXT NOT NULL,
+                                batch_id INTEGER NOT NULL,
+                                molecule_id INTEGER NOT NULL,
+                                project TEXT NOT NULL,
+                                created_at TEXT NOT NULL,
+                                PRIMARY KEY (vault_id, batch_id))""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS molecule_batches_molecule ON molecule_batches (vault_id, molecule_id)")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS molecule_index_syncs (
+                                vault_id TEXT PRIMARY KEY,
+                                synced_at TEXT NOT NULL)""")
+
+    def get_watermark(self, vault_id):
+        with self._lock:
+            row = self._conn.execute("SELECT synced_at FROM molecule_index_syncs WHERE vault_id = ?",
+                                     (str(vault_id),)).fetchone()
+        return row[0] if row else None
+
+    def window_start(self):
+        return (datetime.now() - timedelta(days=self.window_days)).date().isoformat()
+
+    def _write(self, statements):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for sql, params in statements:
+                    self._conn.executemany(sql, params)
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _write_chunk(self, rows, removed):
+        self._write([("INSERT OR REPLACE INTO molecule_batches VALUES (?, ?, ?, ?, ?)", rows),
+                     ("DELETE FROM molecule_batches WHERE vault_id = ? AND batch_id = ?", removed)])
+
+    def update(self, vault_id, batches, synced_at, project_field=None):
+        """
+        Record the modified batches under their project field value, batches left without one are removed.
+        batches is consumed page by page and written every UPDATE_CHUNK_SIZE batches; the watermark only moves once
+        all were written, so an interrupted update is fetched again.
+        """
+        project_field = project_field or settings.CDD_PROJECT_NAME_LABEL
+        rows = []
+        removed = []
+        updated = deleted = 0
+        for batch in batches:
+            project = (batch.get('batch_fields') or {}).get(project_field)
+            if project:
+                rows.append((str(vault_id), batch['id'], batch['molecule']['id'], str(project),
+                             (batch.get('created_at') or synced_at)[:10]))
+            else:
+                removed.append((str(vault_id), batch['id']))
+            if len(rows) + len(removed) >= UPDATE_CHUNK_SIZE:
+                self._write_chunk(rows, removed)
+                updated, deleted = updated + len(rows), deleted + len(removed)
+                rows, removed = [], []
+        self._write_chunk(rows, removed)
+        updated, deleted = updated + len(rows), deleted + len(removed)
+        self._write([("INSERT OR REPLACE INTO molecule_index_syncs VALUES (?, ?)", [(str(vault_id), synced_at)]),
+                     ("DELETE FROM molecule_batches WHERE vault_id = ? AND created_at < ?",
+                      [(str(vault_id), self.window_start())])])
+        root_log.info("Molecule index: {} batches updated, {} removed, synced at {}".format(updated, deleted, synced_at))
+
+    def projects_for_molecules(self, vault_id, molecule_ids, projects=None):
+        molecule_ids = [_ for _ in molecule_ids if _ is not None]
+        found = set()
+        with self._lock:
+            for i in range(0, len(molecule_ids), SQLITE_MAX_PARAMS):
+                chunk = molecule_ids[i:i + SQLITE_MAX_PARAMS]
+                query = "SELECT DISTINCT project FROM molecule_batches WHERE vault_id = ? AND molecule_id IN ({})".format(
+                    ", ".join("?" * len(chunk)))
+                found.update(_[0] for _ in self._conn.execute(query, [str(vault_id)] + chunk))
+        return [_ for _ in found if projects is None or _ in projects]
+
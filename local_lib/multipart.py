@@ -0,0 +1,112 @@
+import uuid
+
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_stream_chunks(stream, chunk_size=CHUNK_SIZE):
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk.encode() if isinstance(chunk, str) else chunk
+
+
+class StreamingMultipartEncoder:
+    """
+    multipart/form-data body that is produced chunk by chunk while requests reads it.
+    fields maps form names to values. files maps form names to (filename, source[, content_type[, size]]) where
+    source is a callable returning a fresh iterable of byte chunks, or a file object.
+    Callable sources can be replayed, which lets the encoder report a Content-Length and be rewound for retries.
+    Passing the size avoids reading a source just to measure it; with measure_unsized=False an unsized source
+    makes the body go out with chunked transfer encoding instead.
+    """
+
+    def __init__(self, fields, files, measure_unsized=True):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = "multipart/form-data; boundary={}".format(self.boundary)
+        self.fields = fields
+        self.files = files
+        self.measure_unsized = measure_unsized
+        self._length = None
+        self._chunks = None
+        self._buffer = b""
+
+    def _part_header(self, name, filename=None, content_type=None):
+        header = '--{}\r\nContent-Disposition: form-data; name="{}"'.format(self.boundary, name)
+        if filename is not None:
+            header += '; filename="{}"\r\nContent-Type: {}'.format(filename.replace('"', '%22'),
+                                                                  content_type or 'application/octet-stream')
+        return (header + "\r\n\r\n").encode()
+
+    def _open_source(self, source):
+        if callable(source):
+            return source()
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        return iter_stream_chunks(source)
+
+    def _iter_parts(self):
+        """Yield the static bytes of the body, and (source, size) for each file's content"""
+        for name, value in self.fields.items():
+            yield self._part_header(name) + str(value).encode() + b"\r\n"
+        for name, file_part in self.files.items():
+            filename, source, content_type, size = (tuple(file_part) + (None, None))[:4]
+            yield self._part_header(name, filename, content_type)
+            yield source, size
+            yield b"\r\n"
+        yield "--{}--\r\n".format(self.boundary).encode()
+
+    def iter_chunks(self):
+        for part in self._iter_parts():
+            if isinstance(part, bytes):
+                yield part
+                continue
+            for chunk in self._open_source(part[0]):
+                if chunk:
+                    yield chunk
+
+    def replayable(self):
+        return all(callable(_[1]) or hasattr(_[1], 'seek') for _ in self.files.values())
+
+    def __bool__(self):
+        return True
+
+    def __len__(self):
+        if not self.replayable():
+            # requests falls back to chunked transfer encoding
+            raise TypeError("length of a one-shot multipart stream is unknown")
+        if self._length is None:
+            length = 0
+            for part in self._iter_parts():
+                if isinstance(part, bytes):
+                    length += len(part)
+                elif part[1] is not None:
+                    length += part[1]
+                elif self.measure_unsized:
+                    length += sum(len(_) for _ in self._open_source(part[0]))
+                else:
+                    raise TypeError("multipart stream has a source of unknown size")
+            self._length = length
+        return self._length
+
+    def __iter__(self):
+        return self.iter_chunks()
+
+    def seek(self, offset):
+        if offset != 0:
+            raise ValueError("StreamingMultipartEncoder can only be rewound to the start")
+        self._chunks = None
+        self._buffer = b""
+
+    def read(self, size=-1):
+        if self._chunks is None:
+            self._chunks = self.iter_chunks()
+        while size is None or size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
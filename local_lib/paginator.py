@@ -0,0 +1,57 @@
+import logging
+import settings
+
+from local_lib.common import ContextThreadPoolExecutor
+
+root_log = logging.getLogger()
+
+
+class Paginator:
+    """
+    Lazily yields the objects of a CDD list endpoint.
+    fetch_page(offset, page_size) returns one page ({'count': ..., 'objects': [...]}); the next page is requested in
+    the background while the current one is consumed. When the first page reports more than async_threshold objects,
+    export() is called instead and its objects are yielded.
+    """
+
+    def __init__(self, name, fetch_page, export=None, page_size=None, async_threshold=None):
+        self.name = name
+        self.fetch_page = fetch_page
+        self.export = export
+        self.page_size = page_size or settings.CDD_PAGE_SIZE
+        self.async_threshold = settings.CDD_ASYNC_EXPORT_THRESHOLD if async_threshold is None else async_threshold
+        self.count = None
+        self.pages = 0
+        self.objects = 0
+        self.exported = False
+
+    def _use_export(self):
+        return self.export is not None and self.async_threshold and self.count > self.async_threshold
+
+    def __iter__(self):
+        with ContextThreadPoolExecutor(max_workers=1) as executor:
+            page = self.fetch_page(0, self.page_size)
+            self.count = page.get('count') or 0
+            if self._use_export():
+                root_log.info("{}: {} objects, using an async export".format(self.name, self.count))
+                self.exported = True
+                for obj in self.export():
+                    self.objects += 1
+                    yield obj
+                return
+            offset = 0
+            while page is not None:
+                objects = page.get('objects') or []
+                self.pages += 1
+                offset += len(objects)
+                pending = None
+                if objects and offset < (page.get('count') or 0):
+                    pending = executor.submit(self.fetch_page, offset, self.page_size)
+                for obj in objects:
+                    self.objects += 1
+                    yield obj
+                page = pending.result() if pending else None
+        root_log.info("{}: {} objects in {} pages".format(self.name, self.objects, self.pages))
+
+    def get_stats(self):
+        return {'count': self.count, 'pages': self.pages, 'objects': self.objects, 'exported': self.exported}
@@ -0,0 +1,40 @@
+import logging
+import settings
+import time
+import traceback
+
+from concurrent.futures import as_completed
+from local_lib.common import ContextThreadPoolExecutor, log_context
+
+root_log = logging.getLogger()
+
+
+def run_for_projects(action, projects, func, max_workers=None):
+    """
+    Call func(project_name, info) for every project in parallel, with the project name as the log context.
+    A failing project does not stop the others; once all are done the failures are reported and raised together.
+    """
+    max_workers = max_workers or settings.PROJECT_WORKERS
+
+    def run(project_name, info):
+        log_context.set(project_name)
+        started = time.monotonic()
+        try:
+            func(project_name, info)
+        except Exception:
+            root_log.error("{} failed for project {}: {}".format(action, project_name, traceback.format_exc()))
+            raise
+        finally:
+            root_log.info("{} for project {} took {:.1f}s".format(action, project_name, time.monotonic() - started))
+
+    failures = {}
+    with ContextThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(run, project_name, info): project_name for project_name, info in projects.items()}
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                failures[futures[future]] = future.exception()
+    root_log.info("{}: {} projects succeeded, {} failed{}".format(
+        action, len(projects) - len(failures), len(failures), " ({})".format(", ".join(sorted(failures))) if failures else ""))
+    if failures:
+        raise Exception("{} failed for projects: {}".format(
+            action, "; ".join("{}: {}".format(name, e) for name, e in sorted(failures.items()))))
@@ -0,0 +1,71 @@
+import logging
+import threading
+import time
+
+from local_lib.constants import *
+
+root_log = logging.getLogger()
+
+
+class TokenBucket:
+    """Thread safe token bucket that backs off when the server reports throttling"""
+
+    def __init__(self, rate, burst=None, min_rate=None, max_block=None):
+        self.max_rate = float(rate)
+        self.rate = self.max_rate
+        self.min_rate = min_rate or self.max_rate * RATE_LIMIT_MIN_FRACTION
+        self.capacity = float(burst or rate)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.blocked_until = 0.0
+        self.max_block = max_block  # cap on a server's Retry-After, like the transport's HTTP_MAX_BACKOFF
+        self.waited = 0.0
+        self.quota = None  # (used, allotted) of the daily access token quota, when the server reports it
+        self._quota_warned = False
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+                self.waited += delay
+            time.sleep(delay)
+
+    def observe(self, headers, throttled, retry_after=None):
+        with self._lock:
+            self._observe_quota(headers)
+            if throttled:
+                self._slow_down(retry_after)
+            elif self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * RATE_LIMIT_RECOVERY_STEP)
+
+    def _observe_quota(self, headers):
+        # a daily quota, slowing the per second rate does not help, so it is only tracked and reported
+        quota_allotted = headers.get('X-Accesstoken-Quota-Allotted')
+        quota_current = headers.get('X-Accesstoken-Quota-Current')
+        if not (quota_allotted and quota_current):
+            return
+        self.quota = (int(quota_current), int(quota_allotted))
+        near_limit = self.quota[0] >= self.quota[1] * RATE_LIMIT_QUOTA_WARNING
+        if near_limit and not self._quota_warned:
+            root_log.warning("Daily API quota at {} of {} requests".format(*self.quota))
+        self._quota_warned = near_limit
+
+    def _slow_down(self, retry_after):
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = min(self.tokens, 0.0)
+        if retry_after and self.max_block is not None:
+            retry_after = min(retry_after, self.max_block)
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        root_log.info("Rate limited, slowing to {:.2f} req/s".format(self.rate))
+
@@ -1,4 +1,7 @@
+from itertools import islice
 from local_lib import common
+
+
 class Protocol:
 
     def __init__(self, protocol_definition):
@@ -18,9 +21,11 @@ class Protocol:
 
 
 class AssayRunFile:
-    def __init__(self, data_array, source_file_name, entry_id, group_id):
+    def __init__(self, data_array, source_file_name, entry_id, group_id, source_path=None, checksum=None):
         self.data_array = data_array
         self.source_file_name = source_file_name
+        self.source_path = source_path
+        self.checksum = checksum
         self.entry_id = entry_id
         self.group_id = group_id
         self.mapping_template = None
@@ -29,6 +34,9 @@ class AssayRunFile:
         self.protocol_conditions = {}
         self.run_key = None
 
+    def iter_rows(self, include_header=True):
+        return islice(self.data_array, 0 if include_header else 1, None)
+
     def validate_and_parse_run_conditions(self, mapping_template, protocols_by_name):
         self.mapping_template = mapping_template
         mapping_headers = mapping_template['header_mappings']
@@ -0,0 +1,177 @@
+import email.utils
+import logging
+import random
+import requests
+import settings
+import threading
+import time
+
+from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from local_lib.common import process_wide
+from local_lib.constants import *
+from local_lib.metrics import get_metrics
+from local_lib.rate_limiter import TokenBucket
+
+root_log = logging.getLogger()
+
+
+@process_wide
+def get_transport():
+    return HttpTransport()
+
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def is_throttled(resp):
+    return resp.status_code == 429 or resp.headers.get('x-mashery-error-code') in EGNYTE_THROTTLE_ERROR_CODES
+
+
+class HttpTransport:
+    """Pooled requests.Session per host with retry/backoff on throttling and server errors"""
+
+    def __init__(self, pool_size=None, max_retries=None, backoff_factor=None, max_backoff=None, timeout=None):
+        self.pool_size = pool_size or settings.HTTP_POOL_SIZE
+        self.max_retries = settings.HTTP_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_factor = settings.HTTP_BACKOFF_FACTOR if backoff_factor is None else backoff_factor
+        self.max_backoff = settings.HTTP_MAX_BACKOFF if max_backoff is None else max_backoff
+        self.timeout = timeout or settings.HTTP_TIMEOUT
+        self._sessions = {}
+        self._rate_limiters = {}
+        self._lock = threading.Lock()
+        self._counters = {'requests': 0, 'retries': 0, 'throttled': 0, 'server_errors': 0, 'connection_errors': 0}
+
+    def session_for(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._sessions[host] = session
+        return session
+
+    def set_rate_limit(self, host, rate, burst=None):
+        with self._lock:
+            if host not in self._rate_limiters:
+                self._rate_limiters[host] = TokenBucket(rate, burst, max_block=self.max_backoff)
+            return self._rate_limiters[host]
+
+    def rate_limiter_for(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            limiter = self._rate_limiters.get(host)
+        if limiter is None and host in settings.RATE_LIMITS:
+            limiter = self.set_rate_limit(host, *settings.RATE_LIMITS[host])
+        return limiter
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._counters[key] += amount
+
+    def _backoff(self, attempt, resp=None):
+        delay = parse_retry_after(resp.headers.get('Retry-After')) if resp is not None else None
+        if delay is None:
+            delay = self.backoff_factor * (2 ** attempt)
+            delay += random.uniform(0, delay / 2)
+        return min(delay, self.max_backoff)
+
+    def _rewind(self, files, data):
+        for value in list((files or {}).values()) + [data]:
+            stream = value[1] if isinstance(value, tuple) else value
+            if hasattr(stream, 'seek'):
+                stream.seek(0)
+
+    def _record_bytes(self, url, resp, stream):
+        host = urlsplit(url).netloc
+        metrics = get_metrics()
+        metrics.inc('http_requests_total', host=host, status=resp.status_code)
+        # chunked streaming uploads have no Content-Length and are not counted
+        sent = resp.request.headers.get('Content-Length') if resp.request is not None else None
+        metrics.inc('http_bytes_sent_total', int(sent or 0), host=host)
+        received = resp.headers.get('Content-Length')
+        if received is None and not stream:
+            received = len(resp.content)
+        metrics.inc('http_bytes_received_total', int(received or 0), host=host)
+
+    def request(self, method, url, timeout=None, **kwargs):
+        session = self.session_for(url)
+        limiter = self.rate_limiter_for(url)
+        kwargs['timeout'] = timeout or self.timeout
+        idempotent = method in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            if limiter:
+                limiter.acquire()
+            self._count('requests')
+            try:
+                resp = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._count('connection_errors')
+                if not idempotent or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                root_log.info("{} {} failed: {}. Retrying in {:.1f}s".format(method, url, e, delay))
+            else:
+                throttled = is_throttled(resp)
+                retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+                if limiter:
+                    limiter.observe(resp.headers, throttled, retry_after)
+                server_error = resp.status_code in RETRY_STATUS_CODES and idempotent
+                if not (throttled or server_error) or attempt >= self.max_retries:
+                    self._record_bytes(url, resp, kwargs.get('stream'))
+                    return resp
+                self._count('throttled' if throttled else 'server_errors')
+                if limiter and throttled and retry_after is not None:
+                    # the rate limiter holds every request to this host until then, the retry waits in acquire()
+                    delay = 0
+                else:
+                    delay = self._backoff(attempt, resp)
+                root_log.info("{} {} returned {}. Retrying in {:.1f}s".format(method, url, resp.status_code, delay))
+                resp.close()
+            self._count('retries')
+            self._rewind(kwargs.get('files'), kwargs.get('data'))
+            time.sleep(delay)
+            attempt += 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            sessions = list(self._sessions.values())
+        connections = requests_sent = 0
+        for session in sessions:
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool is not None:
+                        connections += pool.num_connections
+                        requests_sent += pool.num_requests
+        with self._lock:
+            stats['rate_limit_wait'] = round(sum(_.waited for _ in self._rate_limiters.values()), 3)
+            stats['daily_quota'] = {host: _.quota for host, _ in self._rate_limiters.items() if _.quota}
+        stats['hosts'] = len(sessions)
+        stats['connections_opened'] = connections
+        stats['connections_reused'] = max(0, requests_sent - connections)
+        return stats
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            session.close()
@@ -0,0 +1,215 @@
+import argparse
+import hmac
+import json
+import logging
+import requests
+import settings
+import threading
+import time
+import traceback
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+root_log = logging.getLogger()
+
+PROCESSED_ACTIONS = ['create', 'move', 'copy']
+
+
+def parse_events(body):
+    """Egnyte events from a webhook body: one event, a list of events, or {'events': [...]}"""
+    payload = json.loads(body or b"null")
+    if isinstance(payload, dict):
+        payload = payload.get('events', [payload])
+    if not isinstance(payload, list):
+        raise ValueError("expected an event object or a list of events")
+    return [_ for _ in payload if isinstance(_, dict)]
+
+
+def iter_target_paths(events, base_path):
+    for event in events:
+        data = event.get('data') or {}
+        target_path = data.get('target_path')
+        if event.get('action') not in PROCESSED_ACTIONS or data.get('is_folder') is True or not target_path:
+            continue
+        if base_path and not target_path.startswith(base_path.rstrip('/') + '/'):
+            continue
+        yield target_path, data.get('target_id')
+
+
+class EventBatcher:
+    """
+    Collects pushed target paths and hands them to handler(entry_ids_by_target_path) in batches.
+    A batch goes out once no event arrived for debounce seconds, once it has been open for max_delay seconds,
+    or once it holds max_batch paths. Paths arriving while a batch is being processed form the next batch.
+    """
+
+    def __init__(self, handler, debounce=None, max_delay=None, max_batch=None):
+        self.handler = handler
+        self.debounce = debounce or settings.EGNYTE_WEBHOOK_DEBOUNCE
+        self.max_delay = max_delay or settings.EGNYTE_WEBHOOK_MAX_DELAY
+        self.max_batch = max_batch or settings.EGNYTE_WEBHOOK_MAX_BATCH
+        self.pending = {}
+        self.first_added = None
+        self.last_added = None
+        self.received = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread = None
+
+    def add(self, target_path, entry_id=None):
+        with self._condition:
+            now = time.monotonic()
+            self.pending.pop(target_path, None)
+            self.pending[target_path] = entry_id
+            self.first_added = self.first_added or now
+            self.last_added = now
+            self.received += 1
+            self._condition.notify()
+
+    def _due_in(self):
+        if not self.pending:
+            return None
+        if self._stopping or len(self.pending) >= self.max_batch:
+            return 0
+        now = time.monotonic()
+        return max(0, min(self.last_added + self.debounce, self.first_added + self.max_delay) - now)
+
+    def _take_batch(self):
+        with self._condition:
+            while True:
+                due_in = self._due_in()
+                if due_in == 0:
+                    break
+                if due_in is None and self._stopping:
+                    return None
+                self._condition.wait(due_in)
+            batch, self.pending = self.pending, {}
+            self.first_added = self.last_added = None
+            return batch
+
+    def _loop(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            self.batches += 1
+            root_log.info("Webhook batch of {} target paths".format(len(batch)))
+            try:
+                self.handler(batch)
+            except Exception:
+                # the poller picks the paths up again on its next reconciliation run
+                self.failed_batches += 1
+                root_log.error("Webhook batch failed: {}".format(traceback.format_exc()))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='webhook-batcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Flush what is pending and wait for the last batch"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def get_stats(self):
+        return {'received': self.received, 'pending': len(self.pending), 'batches': self.batches,
+                'failed_batches': self.failed_batches}
+
+
+class WebhookReceiver:
+    """Local HTTP endpoint accepting Egnyte event notifications (POST /egnyte/events) into an EventBatcher"""
+
+    def __init__(self, batcher, host=None, port=None, base_path=None, auth_header=None, max_body=None):
+        self.batcher = batcher
+        self.host = host or settings.EGNYTE_WEBHOOK_HOST
+        self.port = settings.EGNYTE_WEBHOOK_PORT if port is None else port
+        self.base_path = settings.EGNYTE_BASE_PATH if base_path is None else base_path
+        self.auth_header = settings.EGNYTE_WEBHOOK_AUTH_HEADER if auth_header is None else auth_header
+        self.max_body = max_body or settings.EGNYTE_WEBHOOK_MAX_BODY
+        self.server = None
+
+    def _make_handler(self):
+        receiver = self
+
+        class WebhookHandler(BaseHTTPRequestHandler):
+
+            def _send(self, code, body):
+                data = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _authorized(self):
+                if not receiver.auth_header:
+                    return True
+                return hmac.compare_digest(self.headers.get('Authorization', '').encode(), receiver.auth_header.encode())
+
+            def do_POST(self):
+                if self.path.rstrip('/') != '/egnyte/events':
+                    return self._send(404, {'error': 'not found'})
+                if not self._authorized():
+                    return self._send(401, {'error': 'unauthorized'})
+                try:
+                    length = int(self.headers.get('Content-Length') or 0)
+                except ValueError:
+                    return self._send(400, {'error': 'invalid Content-Length'})
+                if length < 0:
+                    return self._send(400, {'error': 'invalid Content-Length'})
+                if length > receiver.max_body:
+                    # answered before reading, the connection is not reused
+                    self.close_connection = True
+                    return self._send(413, {'error': 'body larger than {} bytes'.format(receiver.max_body)})
+                try:
+                    events = parse_events(self.rfile.read(length))
+                except ValueError as e:
+                    return self._send(400, {'error': str(e)})
+                accepted = 0
+                for target_path, entry_id in iter_target_paths(events, receiver.base_path):
+                    receiver.batcher.add(target_path, entry_id)
+                    accepted += 1
+                self._send(202, {'events': len(events), 'accepted': accepted})
+
+            def log_message(self, format, *args):
+                root_log.debug("Webhook receiver: " + format % args)
+
+        return WebhookHandler
+
+    def start(self):
+        self.batcher.start()
+        self.server = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='webhook', daemon=True).start()
+        root_log.info("Egnyte webhook receiver on http://{}:{}/egnyte/events".format(*self.server.server_address[:2]))
+
+    def stop(self, timeout=None):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        self.batcher.stop(timeout)
+
+
+def send_events(url, target_paths, action='create', auth_header=None):
+    """Stand-in for Egnyte: post one event per target path in the events API format"""
+    events = [{'id': i, 'action': action, 'type': 'file_system', 'timestamp': time.time(),
+               'data': {'target_path': target_path, 'is_folder': False}}
+              for i, target_path in enumerate(target_paths)]
+    headers = {'Authorization': auth_header} if auth_header else {}
+    resp = requests.post(url, json={'events': events}, headers=headers, timeout=30)
+    resp.raise_for_status()
+    return resp.json()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Send stand-in Egnyte events to a local webhook receiver.')
+    parser.add_argument('target_paths', nargs='+')
+    parser.add_argument('--url', default='http://127.0.0.1:{}/egnyte/events'.format(settings.EGNYTE_WEBHOOK_PORT or 8766))
+    parser.add_argument('--action', default='create')
+    parser.add_argument('--auth-header')
+    args = parser.parse_args()
+    print(send_events(args.url, args.target_paths, args.action, args.auth_header))
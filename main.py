@@ -3,37 +3,148 @@ import sys
 from local_lib.cdd_interface import CddInterface
 from local_lib.egnyte_interface import EgnyteInterface
 from local_lib import common
+from local_lib.async_jobs import set_stop_event
+from local_lib.cache import get_cache
+from local_lib.daemon import Daemon, ScheduledTask
+from local_lib.metrics import get_metrics
+from local_lib.project_executor import run_for_projects
+from local_lib.transport import get_transport
+from local_lib.webhook_receiver import EventBatcher, WebhookReceiver
 
 import argparse
 import settings
+import signal
+import threading
 import traceback
 
 log_stream, root_log = common.set_up_logging()
+_interfaces = {}
 
 
-def sync_egnyte_assay_files(dry_run):
-    for project_name, research_projects in settings.CDD_PROJECTS.items():
+def get_sync_interface(project_name, dry_run):
+    """EgnyteInterface (with its CddInterface) for the Egnyte sync, reused across daemon runs"""
+    key = ('egnyte_sync', project_name, dry_run)
+    if key not in _interfaces:
         cdd_interface = CddInterface(settings.CDD_KEY, settings.CDD_VAULT_ID, dry_run=dry_run)
-        egnyte_interface = EgnyteInterface(settings.EGNYTE_DOMAIN, settings.EGNYTE_ACCESS_TOKEN, cdd_interface=cdd_interface,
+        _interfaces[key] = EgnyteInterface(settings.EGNYTE_DOMAIN, settings.EGNYTE_ACCESS_TOKEN, cdd_interface=cdd_interface,
                                            project_id=project_name, dry_run=dry_run)
-        egnyte_interface.process_new_assay_files(settings.EGNYTE_BASE_PATH)
+    return _interfaces[key]
 
 
-def process_cdd_assay_runs(dry_run):
-    for project_name, info in settings.CDD_PROJECTS.items():
+def get_runs_interface(project_name, info, dry_run):
+    """CddInterface (with its EgnyteInterface) for CDD run processing, reused across daemon runs"""
+    key = ('cdd_assay_runs', project_name, dry_run)
+    if key not in _interfaces:
         egnyte_interface = EgnyteInterface(settings.EGNYTE_DOMAIN, settings.EGNYTE_ACCESS_TOKEN,
                                            project_id=project_name, dry_run=dry_run)
-        cdd_interface = CddInterface(settings.CDD_KEY, settings.CDD_VAULT_ID, egnyte_interface=egnyte_interface, research_projects=info['research_projects'],
-                                     dry_run=dry_run)
-        cdd_interface.process_runs()
+        _interfaces[key] = CddInterface(settings.CDD_KEY, settings.CDD_VAULT_ID, egnyte_interface=egnyte_interface,
+                                        research_projects=info['research_projects'], dry_run=dry_run)
+    return _interfaces[key]
+
+
+def get_sync_projects():
+    """
+    The Egnyte sync shares one event cursor per domain, so it runs once in the first project of CDD_PROJECTS
+    rather than in whichever project thread takes the cursor first
+    """
+    project_name = next(iter(settings.CDD_PROJECTS))
+    return {project_name: settings.CDD_PROJECTS[project_name]}
+
+
+def sync_egnyte_assay_files(dry_run):
+    run_for_projects('Egnyte sync', get_sync_projects(),
+                     lambda project_name, info: get_sync_interface(project_name, dry_run).process_new_assay_files(
+                         settings.EGNYTE_BASE_PATH))
+
+
+def process_cdd_assay_runs(dry_run):
+    run_for_projects('CDD assay runs', settings.CDD_PROJECTS,
+                     lambda project_name, info: get_runs_interface(project_name, info, dry_run).process_runs())
+
+
+def process_pushed_target_paths(entry_ids_by_target_path, dry_run):
+    run_for_projects('Egnyte webhook', get_sync_projects(),
+                     lambda project_name, info: get_sync_interface(project_name, dry_run).process_target_paths(
+                         entry_ids_by_target_path))
+
+
+def exporting_metrics(func):
+    """Refresh the Prometheus file after every daemon run"""
+    def run():
+        try:
+            func()
+        finally:
+            get_metrics().write_prometheus()
+    return run
+
+
+def run_daemon(args):
+    run_all = args.all or not (args.egnyte_sync or args.cdd_assay_runs)
+    tasks = []
+    receiver = None
+    if run_all or args.egnyte_sync:
+        tasks.append(ScheduledTask('egnyte_sync', exporting_metrics(lambda: sync_egnyte_assay_files(args.dry)),
+                                   settings.DAEMON_EGNYTE_SYNC_INTERVAL))
+        if settings.EGNYTE_WEBHOOK_PORT is not None:
+            receiver = WebhookReceiver(EventBatcher(lambda batch: process_pushed_target_paths(batch, args.dry)))
+    if run_all or args.cdd_assay_runs:
+        tasks.append(ScheduledTask('cdd_assay_runs', exporting_metrics(lambda: process_cdd_assay_runs(args.dry)),
+                                   settings.DAEMON_CDD_ASSAY_RUNS_INTERVAL))
+
+    def get_stats():
+        stats = {'transport': get_transport().get_stats(), 'cache': get_cache().get_stats()}
+        if receiver:
+            stats['webhook'] = receiver.batcher.get_stats()
+        return stats
+
+    if receiver:
+        receiver.start()
+    try:
+        Daemon(tasks, extra_status=get_stats).run()
+    finally:
+        if receiver:
+            receiver.stop(settings.DAEMON_SHUTDOWN_TIMEOUT)
+
+
+def run_once(args):
+    """
+    Run the selected actions once. Ctrl-C or SIGTERM cancels the pending CDD exports and lets the running projects
+    finish and flush their queued Egnyte metadata, a second signal gets the default handling.
+    """
+    stopping = threading.Event()
+    set_stop_event(stopping)
+    default_handlers = {signum: signal.getsignal(signum) for signum in (signal.SIGINT, signal.SIGTERM)}
+
+    def stop(signum, frame):
+        root_log.info("Received signal {}, cancelling the pending CDD jobs and finishing the running projects".format(signum))
+        stopping.set()
+        for _signum, handler in default_handlers.items():
+            signal.signal(_signum, handler)
+
+    for signum in default_handlers:
+        signal.signal(signum, stop)
+    try:
+        if args.all or args.egnyte_sync:
+            sync_egnyte_assay_files(args.dry)
+        if (args.all or args.cdd_assay_runs) and not stopping.is_set():
+            process_cdd_assay_runs(args.dry)
+    finally:
+        set_stop_event(None)
+        for signum, handler in default_handlers.items():
+            signal.signal(signum, handler)
 
 
 def main(args):
-    dry_run = args.dry
-    if args.all or args.egnyte_sync:
-        sync_egnyte_assay_files(dry_run)
-    if args.all or args.cdd_assay_runs:
-        process_cdd_assay_runs(dry_run)
+    if args.invalidate_cache is not None:
+        get_cache().invalidate(args.invalidate_cache or None)
+    if args.daemon:
+        run_daemon(args)
+    else:
+        run_once(args)
+    root_log.info("HTTP transport stats: {}".format(get_transport().get_stats()))
+    root_log.info("CDD cache stats: {}".format(get_cache().get_stats()))
+    get_metrics().write_prometheus()
+    get_metrics().write_summary()
 
 
 if __name__ == '__main__':
@@ -42,6 +153,10 @@ if __name__ == '__main__':
     parser.add_argument('--all', action='store_true', help='Perform all actions')
     parser.add_argument('--cdd-assay-runs', action='store_true', help='Process CDD Assay Runs')
     parser.add_argument('--egnyte-sync', action='store_true', help='Process Egnyte Sync')
+    parser.add_argument('--daemon', action='store_true',
+                        help='Keep running and repeat the selected actions (all by default) on their configured intervals')
+    parser.add_argument('--invalidate-cache', nargs='?', const='', metavar='KEY_PREFIX',
+                        help='Clear the CDD template/protocol cache (optionally only keys starting with KEY_PREFIX)')
     args = parser.parse_args()
     root_log.info(args)
     main(args)
@@ -1,3 +1,76 @@
+#HTTP (defaults, override in local settings)
+HTTP_POOL_SIZE = 10
+HTTP_MAX_RETRIES = 5
+HTTP_BACKOFF_FACTOR = 0.5
+HTTP_MAX_BACKOFF = 60
+HTTP_TIMEOUT = (10, 300)
+RATE_LIMITS = {}  # {host: (requests per second, burst)}
+EGNYTE_RATE_LIMIT = (5, 5)
+EGNYTE_BASE_URL = "https://{domain}"  # point at a stand-in server for offline benchmarks
+EGNYTE_EVENT_PAGE_SIZE = 100  # the events API caps a page at 100
+EGNYTE_EVENT_PAGE_RETRIES = 3
+
+#CONCURRENCY (1 download worker keeps the serial path)
+PROJECT_WORKERS = 4  # projects processed in parallel by main.py
+EGNYTE_DOWNLOAD_WORKERS = 8
+ASSAY_PARSE_PROCESSES = None  # defaults to os.cpu_count()
+CDD_UPLOAD_CONCURRENCY = 4  # 1 submits and waits for each run group in turn
+EGNYTE_METADATA_WORKERS = 8
+EGNYTE_METADATA_BATCH_SIZE = 50  # queued metadata writes sent per batch, a full queue is flushed early
+
+#ASSAY FILE PARSING
+ASSAY_WORKBOOK_READ_ONLY = True
+ASSAY_SPOOL_THRESHOLD = 20 * 1024 * 1024  # downloads above this size are spooled to a temp file
+ASSAY_CONTENT_CACHE_PATH = "assay_content_cache.sqlite3"  # parsed workbooks and uploads by Egnyte checksum
+ASSAY_CONTENT_CACHE_TTL = 30 * 24 * 60 * 60
+ASSAY_CONTENT_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+#CHECKPOINTS
+CHECKPOINT_PATH = "checkpoints.sqlite3"
+CHECKPOINT_RETENTION_DAYS = 14
+
+#CDD CACHE
+CDD_CACHE_PATH = "cdd_cache.sqlite3"
+CDD_CACHE_TTL = 6 * 60 * 60
+CDD_CACHE_MAX_BYTES = 50 * 1024 * 1024
+CDD_MOLECULE_INDEX_PATH = "cdd_molecule_index.sqlite3"
+CDD_MOLECULE_INDEX_WINDOW_DAYS = 120
+CDD_READOUT_ROW_RUN_BATCH_SIZE = 100
+CDD_STREAMING_UPLOAD = True
+CDD_UPLOAD_CHUNK_SIZE = 64 * 1024
+CDD_ATTACHMENT_CONCURRENCY = 4
+CDD_PROTOCOL_PAGE_SIZE = 50  # protocols per page when looking for new runs, each carries all of its runs
+CDD_RUNS_INITIAL_WINDOW_DAYS = 1  # first look back, afterwards the watermark in the checkpoint store is used
+CDD_RUNS_WATERMARK_OVERLAP = 10 * 60  # seconds the next pass looks back before this one started
+
+#CDD ASYNC EXPORT / SLURP POLLING
+CDD_PAGE_SIZE = 1000  # objects per page for list endpoints, the API maximum
+CDD_ASYNC_EXPORT_THRESHOLD = 10000  # larger result sets are exported instead of paged, None always pages
+CDD_EXPORT_CHUNK_SIZE = 1024 * 1024  # exports are downloaded to a temp file and decoded one object at a time
+CDD_POLL_INITIAL_INTERVAL = 2
+CDD_POLL_MAX_INTERVAL = 30
+CDD_JOB_DEADLINE = 4 * 60 * 60
+
+#METRICS (None disables the export)
+METRICS_PROMETHEUS_PATH = None  # e.g. a node_exporter textfile collector path ending in .prom
+METRICS_SUMMARY_PATH = None  # JSON summary written at the end of a run, e.g. "metrics/run-{timestamp}.json"
+
+#DAEMON (main.py --daemon)
+DAEMON_EGNYTE_SYNC_INTERVAL = 5 * 60
+DAEMON_CDD_ASSAY_RUNS_INTERVAL = 15 * 60
+DAEMON_HEALTH_HOST = "127.0.0.1"
+DAEMON_HEALTH_PORT = 8765  # None disables the health endpoint
+DAEMON_SHUTDOWN_TIMEOUT = 10 * 60  # how long a signal waits for running tasks to finish
+
+#EGNYTE WEBHOOK RECEIVER (daemon only, the event poller stays on as the reconciliation path)
+EGNYTE_WEBHOOK_HOST = "127.0.0.1"
+EGNYTE_WEBHOOK_PORT = None  # e.g. 8766, None disables the receiver
+EGNYTE_WEBHOOK_AUTH_HEADER = None  # expected Authorization header, as configured on the Egnyte webhook
+EGNYTE_WEBHOOK_DEBOUNCE = 5
+EGNYTE_WEBHOOK_MAX_DELAY = 60
+EGNYTE_WEBHOOK_MAX_BATCH = 200
+EGNYTE_WEBHOOK_MAX_BODY = 1024 * 1024  # bytes, larger requests are refused with a 413
+
 from local_settings_mtx import *
 
 CDD_BASE_URL = "https://app.collaborativedrug.com/api/v1/vaults"
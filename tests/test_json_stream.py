@@ -0,0 +1,68 @@
+import io
+import json
+
+import pytest
+
+from local_lib.json_stream import iter_json_array
+
+ITEMS = [
+    {'id': 1, 'name': 'plain'},
+    {'id': -22, 'value': 3.5e-3, 'flags': [True, False, None]},
+    {'name': 'quote \" backslash \\\\ brace } bracket ] comma ,', 'unicode': 'café ☃'},
+    12345678901234567890,
+    'a string with \\u escapes and \"quotes\"',
+    [],
+    {},
+]
+
+
+def decode(text, key=None, chunk_size=1):
+    return list(iter_json_array(io.StringIO(text), key, chunk_size))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 64 * 1024])
+def test_top_level_array_split_at_every_boundary(chunk_size):
+    assert decode(json.dumps(ITEMS), chunk_size=chunk_size) == ITEMS
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 64 * 1024])
+def test_array_under_key(chunk_size):
+    text = json.dumps({'count': len(ITEMS), 'meta': {'objects': ['not', 'these']}, 'objects': ITEMS, 'after': 1})
+    assert decode(text, 'objects', chunk_size) == ITEMS
+
+
+def test_escapes_split_inside_the_escape():
+    text = '["\\\\", "\\"", "\\u00e9x", "a\\nb"]'
+    for chunk_size in range(1, len(text) + 1):
+        assert decode(text, chunk_size=chunk_size) == ['\\', '"', 'éx', 'a\nb']
+
+
+def test_number_split_before_its_end():
+    # 12 must not be decoded as 1 when the chunk ends after the first digit
+    assert decode('[12,345 , -6.5e2]', chunk_size=1) == [12, 345, -650.0]
+    assert decode('[7]', chunk_size=1) == [7]
+
+
+def test_whitespace_and_empty_arrays():
+    assert decode(' \n[ ]\n') == []
+    assert decode('{ "objects" : [ ] }', 'objects') == []
+    assert decode('{}', 'objects') == []
+    assert decode('{"other": [1]}', 'objects') == []
+
+
+def test_top_level_array_when_a_key_is_given():
+    assert decode('[1, 2]', 'objects') == [1, 2]
+
+
+def test_items_are_yielded_before_the_end_is_read():
+    items = iter_json_array(io.StringIO('[{"id": 1}, {"id": 2}, '), chunk_size=4)
+    assert next(items) == {'id': 1}
+    assert next(items) == {'id': 2}
+    with pytest.raises(ValueError):
+        next(items)
+
+
+@pytest.mark.parametrize('text', ['', '{"id": 1}', '[1 2]', '[1,', '[{"id": 1]'])
+def test_malformed_input_raises(text):
+    with pytest.raises(ValueError):
+        decode(text, chunk_size=2)
@@ -0,0 +1,108 @@
+import pytest
+
+from local_lib.checkpoint import CheckpointStore
+from local_lib.metadata_writer import MetadataWriter
+
+SCOPE = 'example.egnyte.com'
+NAMESPACE = 'CDD'
+
+
+class Recorder:
+    """write() for the MetadataWriter that records the writes and fails the group ids in fail"""
+
+    def __init__(self):
+        self.writes = []
+        self.fail = set()
+        self.during_write = None
+
+    def __call__(self, data, group_id, namespace):
+        if self.during_write:
+            during_write, self.during_write = self.during_write, None
+            during_write()
+        if group_id in self.fail:
+            raise Exception("write of {} failed".format(group_id))
+        self.writes.append((group_id, namespace, dict(data)))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return CheckpointStore(str(tmp_path / 'checkpoints.sqlite3'))
+
+
+def journal(store):
+    """The journaled writes nobody confirmed, as another process would find them"""
+    rows = store.claim_metadata(SCOPE, 'inspector')
+    for group_id, namespace, _, _ in rows:
+        store.release_metadata(SCOPE, group_id, namespace)
+    return {(group_id, namespace): data for group_id, namespace, data, _ in rows}
+
+
+def test_writes_to_the_same_file_are_merged(store):
+    write = Recorder()
+    writer = MetadataWriter(write, SCOPE, store, workers=2, batch_size=10)
+    written = []
+    writer.set('g1', NAMESPACE, {'status': 'Processing', 'slurp id': '1'}, lambda: written.append('first'))
+    writer.set('g1', NAMESPACE, {'status': 'Success'}, lambda: written.append('second'))
+    writer.set('g2', NAMESPACE, {'status': 'Failed'})
+    assert journal(store) == {('g1', NAMESPACE): {'status': 'Success', 'slurp id': '1'},
+                              ('g2', NAMESPACE): {'status': 'Failed'}}
+    writer.flush()
+    assert sorted(write.writes) == [('g1', NAMESPACE, {'status': 'Success', 'slurp id': '1'}),
+                                    ('g2', NAMESPACE, {'status': 'Failed'})]
+    assert written == ['first', 'second']
+    assert journal(store) == {}
+    assert writer.get_stats()['coalesced'] == 1
+
+
+def test_failed_write_is_replayed_by_the_next_run(store):
+    write = Recorder()
+    write.fail.add('g1')
+    writer = MetadataWriter(write, SCOPE, store, workers=1, batch_size=10)
+    written = []
+    writer.set('g1', NAMESPACE, {'status': 'Success'}, lambda: written.append('g1'))
+    writer.set('g2', NAMESPACE, {'status': 'Success'})
+    with pytest.raises(Exception, match="1 of 2 Egnyte metadata writes failed"):
+        writer.flush()
+    assert written == []
+    assert journal(store) == {('g1', NAMESPACE): {'status': 'Success'}}
+
+    write.fail.clear()
+    assert writer.replay() == 1
+    writer.flush()
+    assert write.writes[-1] == ('g1', NAMESPACE, {'status': 'Success'})
+    assert journal(store) == {}
+    assert writer.replay() == 0
+
+
+def test_writes_left_by_a_crashed_process_are_replayed(store):
+    store.journal_metadata(SCOPE, 'g1', NAMESPACE, {'status': 'Success'}, 'crashed-process')
+    store.journal_metadata('other.egnyte.com', 'g9', NAMESPACE, {'status': 'Success'}, 'crashed-process')
+    write = Recorder()
+    writer = MetadataWriter(write, SCOPE, store, workers=1, batch_size=10)
+    assert writer.replay() == 1
+    writer.flush()
+    assert write.writes == [('g1', NAMESPACE, {'status': 'Success'})]
+    assert store.claim_metadata('other.egnyte.com', 'inspector')
+
+
+def test_write_merged_while_sending_is_not_cleared(store):
+    write = Recorder()
+    writer = MetadataWriter(write, SCOPE, store, workers=1, batch_size=10)
+    writer.set('g1', NAMESPACE, {'status': 'Processing'})
+    # a newer status journaled while the older one is on the wire must outlive the older one's confirmation
+    write.during_write = lambda: store.journal_metadata(SCOPE, 'g1', NAMESPACE, {'status': 'Success'}, 'crashed-process')
+    writer.flush()
+    assert write.writes == [('g1', NAMESPACE, {'status': 'Processing'})]
+    assert journal(store) == {('g1', NAMESPACE): {'status': 'Success'}}
+
+
+def test_flush_of_a_full_queue_only_logs_and_the_next_flush_raises(store):
+    write = Recorder()
+    write.fail.add('g1')
+    writer = MetadataWriter(write, SCOPE, store, workers=1, batch_size=2)
+    writer.set('g1', NAMESPACE, {'status': 'Success'})
+    writer.set('g2', NAMESPACE, {'status': 'Success'})
+    assert writer.get_stats()['pending'] == 0
+    with pytest.raises(Exception, match="1 of 2"):
+        writer.flush()
+    writer.flush()
@@ -0,0 +1,87 @@
+import io
+
+import pytest
+
+from local_lib.multipart import StreamingMultipartEncoder
+
+CONTENT = b"compound,value\n" + b"CMPD-1,0.5\n" * 5000
+
+
+def chunked_source(data, chunk_size=1000, calls=None):
+    def source():
+        if calls is not None:
+            calls.append(1)
+        return (data[i:i + chunk_size] for i in range(0, len(data), chunk_size))
+    return source
+
+
+def read_all(encoder, size):
+    parts = []
+    while True:
+        data = encoder.read(size)
+        if not data:
+            return b"".join(parts)
+        parts.append(data)
+
+
+def test_body_layout():
+    encoder = StreamingMultipartEncoder({'json': '{"a": 1}'}, {'file': ('run "1".csv', chunked_source(CONTENT), 'text/csv')})
+    body = b"".join(encoder)
+    boundary = encoder.boundary.encode()
+    assert encoder.content_type == "multipart/form-data; boundary={}".format(encoder.boundary)
+    assert body.startswith(b"--" + boundary + b'\r\nContent-Disposition: form-data; name="json"\r\n\r\n{"a": 1}\r\n')
+    assert b'name="file"; filename="run %221%22.csv"\r\nContent-Type: text/csv\r\n\r\n' + CONTENT + b"\r\n" in body
+    assert body.endswith(b"--" + boundary + b"--\r\n")
+
+
+@pytest.mark.parametrize('file_part', [
+    ('run.csv', chunked_source(CONTENT)),
+    ('run.csv', chunked_source(CONTENT), 'text/csv', len(CONTENT)),
+    ('run.csv', io.BytesIO(CONTENT)),
+    ('run.csv', io.StringIO(CONTENT.decode())),
+])
+def test_content_length_matches_the_body(file_part):
+    encoder = StreamingMultipartEncoder({'json': '{}'}, {'file': file_part})
+    assert len(encoder) == len(b"".join(encoder))
+    assert len(encoder) == len(read_all(encoder, 777))
+
+
+def test_known_size_is_not_measured():
+    calls = []
+    encoder = StreamingMultipartEncoder({}, {'file': ('run.csv', chunked_source(CONTENT, calls=calls), None, len(CONTENT))})
+    len(encoder)
+    assert calls == []
+    calls = []
+    encoder = StreamingMultipartEncoder({}, {'file': ('run.csv', chunked_source(CONTENT, calls=calls))})
+    len(encoder)
+    len(encoder)
+    assert calls == [1]
+
+
+def test_unknown_length_falls_back_to_chunked():
+    one_shot = StreamingMultipartEncoder({}, {'file': ('run.csv', iter([CONTENT]))})
+    with pytest.raises(TypeError):
+        len(one_shot)
+    unmeasured = StreamingMultipartEncoder({}, {'file': ('run.csv', chunked_source(CONTENT))}, measure_unsized=False)
+    with pytest.raises(TypeError):
+        len(unmeasured)
+    assert bool(unmeasured)
+
+
+@pytest.mark.parametrize('source', [chunked_source(CONTENT), io.BytesIO(CONTENT)])
+def test_rewind_replays_the_whole_body(source):
+    encoder = StreamingMultipartEncoder({'json': '{}'}, {'file': ('run.csv', source)})
+    expected = b"".join(encoder)
+    # a retry after part of the body went out starts again from the first byte
+    assert encoder.read(100) == expected[:100]
+    encoder.read(5000)
+    encoder.seek(0)
+    assert read_all(encoder, 4096) == expected
+    encoder.seek(0)
+    assert encoder.read() == expected
+
+
+def test_rewind_only_to_the_start():
+    encoder = StreamingMultipartEncoder({}, {'file': ('run.csv', chunked_source(CONTENT))})
+    with pytest.raises(ValueError):
+        encoder.seek(10)
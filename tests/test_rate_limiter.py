@@ -0,0 +1,95 @@
+import pytest
+
+from local_lib import rate_limiter
+from local_lib.constants import RATE_LIMIT_MIN_FRACTION, RATE_LIMIT_RECOVERY_STEP
+from local_lib.rate_limiter import TokenBucket
+
+
+class FakeTime:
+    """Stands in for the time module of rate_limiter, sleeping only moves the clock"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(rate_limiter, 'time', clock)
+    return clock
+
+
+def test_burst_then_refill_at_the_rate(clock):
+    bucket = TokenBucket(2, burst=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.sleeps == []
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(0.5)]
+    assert bucket.waited == pytest.approx(0.5)
+
+
+def test_refill_is_capped_at_the_burst(clock):
+    bucket = TokenBucket(2, burst=3)
+    for _ in range(3):
+        bucket.acquire()
+    clock.now += 60
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.sleeps == []
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+
+def test_throttling_halves_the_rate_down_to_the_minimum(clock):
+    bucket = TokenBucket(10)
+    bucket.observe({}, True)
+    assert bucket.rate == 5
+    for _ in range(10):
+        bucket.observe({}, True)
+    assert bucket.rate == pytest.approx(10 * RATE_LIMIT_MIN_FRACTION)
+
+
+def test_rate_recovers_after_throttling(clock):
+    bucket = TokenBucket(10)
+    bucket.observe({}, True)
+    bucket.observe({}, False)
+    assert bucket.rate == pytest.approx(5 + 10 * RATE_LIMIT_RECOVERY_STEP)
+    for _ in range(100):
+        bucket.observe({}, False)
+    assert bucket.rate == 10
+
+
+def test_retry_after_blocks_every_caller(clock):
+    bucket = TokenBucket(10)
+    bucket.observe({}, True, retry_after=30)
+    assert bucket.blocked_until == clock.now + 30
+    bucket.acquire()
+    assert sum(clock.sleeps) == pytest.approx(30)
+    # a shorter Retry-After does not lift an earlier block
+    bucket.observe({}, True, retry_after=60)
+    bucket.observe({}, True, retry_after=1)
+    assert bucket.blocked_until == clock.now + 60
+
+
+def test_retry_after_is_capped_by_max_block(clock):
+    bucket = TokenBucket(10, max_block=20)
+    bucket.observe({}, True, retry_after=3600)
+    assert bucket.blocked_until == clock.now + 20
+    bucket.observe({}, True, retry_after=5)
+    assert bucket.blocked_until == clock.now + 20
+
+
+def test_quota_is_tracked_without_slowing_down(clock):
+    bucket = TokenBucket(10)
+    bucket.observe({'X-Accesstoken-Quota-Allotted': '1000', 'X-Accesstoken-Quota-Current': '950'}, False)
+    assert bucket.quota == (950, 1000)
+    assert bucket.rate == 10